@@ -1,16 +1,82 @@
-import os, json, sqlite3
+import os, time, asyncio
+_IMPORT_T0 = time.perf_counter()
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any, Literal
 from fastapi import FastAPI, Header, HTTPException, Request, Query
 from pydantic import BaseModel
-from fastapi.responses import HTMLResponse
-from azure.data.tables import TableServiceClient
-import uuid
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+import uuid, hashlib
+from catalog import epoch
+from catalog_manager import CatalogManager, FileSource, SnapshotFile
+from catalog_file import MappedSource
+import negotiation, backhaul, geo, call_plan
+from writebehind import CallLogWriter, MemoryTableClient, QueueFull, RecentIds
+from store import CallStore
+import rollups, metrics, telemetry, export, live, partitions
+from archive import Archive, Retention
+from search_cache import SearchCache, key_for
 
 API_KEY = os.getenv("API_KEY", "")
 DB_PATH = os.getenv("DB_PATH", "calls.db")
+LOADS_PATH = os.getenv("LOADS_PATH", "loads.json")
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "5"))
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "loads.snapshot")  # "" disables
+CATALOG_FILE = os.getenv("CATALOG_FILE", "")  # shared mapped catalog for multi-worker runs (see catalog_file.py)
+# no Azure at all (explicit opt-in): the newest table entities stay in memory, SQLite is the record
+LOCAL_MODE = os.getenv("LOCAL_MODE", "") == "1"
+LOCAL_TABLE_MAX_ENTITIES = int(os.getenv("LOCAL_TABLE_MAX_ENTITIES", "10000"))
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+CALL_LOG_SHARDS = int(os.getenv("CALL_LOG_SHARDS", "4"))  # Azure partitions per day (see partitions.py)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))  # 0 keeps every call in SQLite
+STARTUP = {}
 
-app = FastAPI(title="Inbound Carrier Sales API")
+# ---------- Lifecycle ----------
+def make_table_client():
+    if LOCAL_MODE:
+        print(f"LOCAL_MODE: only the last {LOCAL_TABLE_MAX_ENTITIES} Azure Table entities are kept, in memory")
+        return MemoryTableClient(max_entities=LOCAL_TABLE_MAX_ENTITIES)
+    if not os.getenv("TABLES_CONN_STRING"):
+        raise RuntimeError("TABLES_CONN_STRING is not set (set LOCAL_MODE=1 to run without Azure)")
+    from azure.data.tables import TableServiceClient  # ~150 ms of imports, kept off the import path
+    service = TableServiceClient.from_connection_string(os.getenv("TABLES_CONN_STRING"))
+    return service.get_table_client(table_name=os.getenv("TABLE_NAME", "calls"))
+
+def timed_step(name: str, fn):
+    def run():
+        t = time.perf_counter()
+        out = fn()
+        STARTUP[f"{name}_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        return out
+    return asyncio.to_thread(run)
+
+@asynccontextmanager
+async def lifespan(app):
+    t0 = time.perf_counter()
+    # independent and mostly I/O or C code: run them side by side
+    _, _, WRITER.table_client = await asyncio.gather(
+        timed_step("catalog", CATALOG.load), timed_step("db", STORE.init_schema),
+        timed_step("table_client", make_table_client))
+    # rows of a day whose archiving crashed before the delete would be served twice
+    await timed_step("archive_reconcile", lambda: ARCHIVE.reconcile(STORE))
+    CATALOG.start()
+    WRITER.start()
+    RETENTION.start()
+    STARTUP.update(import_ms=round((t0 - _IMPORT_T0) * 1000, 1), startup_ms=round((time.perf_counter() - t0) * 1000, 1),
+                   catalog_mode=CATALOG.stats["mode"], local_mode=LOCAL_MODE, budget_ms=STARTUP_BUDGET_MS)
+    STARTUP["within_budget"] = STARTUP["import_ms"] + STARTUP["startup_ms"] <= STARTUP_BUDGET_MS
+    if not STARTUP["within_budget"]:
+        print("Startup over budget:", STARTUP)
+    yield
+    CATALOG.stop()
+    RETENTION.stop()
+    LIVE.close()
+    await WRITER.stop()
+    STORE.close()
+
+app = FastAPI(title="Inbound Carrier Sales API", lifespan=lifespan)
+app.add_middleware(telemetry.TelemetryMiddleware, api_key=API_KEY)
 
 # ---------- Security ----------
 def require_api_key(x_api_key: str | None):
@@ -18,36 +84,17 @@ def require_api_key(x_api_key: str | None):
         raise HTTPException(status_code=401, detail="Invalid API key")
 
 # ---------- Data ----------
-with open("loads.json") as f:
-    LOADS = json.load(f)
+# nothing is read here; the lifespan loads the catalog and opens the DB
+if CATALOG_FILE:
+    CATALOG = CatalogManager(MappedSource(LOADS_PATH, CATALOG_FILE), poll_seconds=CATALOG_POLL_SECONDS)
+else:
+    CATALOG = CatalogManager(FileSource(LOADS_PATH), poll_seconds=CATALOG_POLL_SECONDS,
+                             snapshot=SnapshotFile(CATALOG_SNAPSHOT_PATH) if CATALOG_SNAPSHOT_PATH else None)
 
 # ---------- DB ----------
-def db():
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
-
-def init_db():
-    con = db()
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS calls (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            call_id TEXT,
-            timestamp TEXT,
-            outcome TEXT,
-            sentiment TEXT,
-            rounds INTEGER,
-            mc TEXT, dot TEXT, legal_name TEXT,
-            selected_load_id TEXT,
-            origin TEXT, destination TEXT,
-            pickup_datetime TEXT, delivery_datetime TEXT,
-            equipment_type TEXT, miles INTEGER,
-            loadboard_rate REAL, agreed_rate REAL,
-            transcript TEXT
-        )
-    """)
-    con.commit(); con.close()
-init_db()
+STORE = CallStore(DB_PATH, readers=int(os.getenv("DB_READERS", "4")))
+ARCHIVE = Archive(ARCHIVE_DIR)
+RETENTION = Retention(ARCHIVE, STORE, RETENTION_DAYS, float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")))
 
 # ---------- Schemas ----------
 class SearchCriteria(BaseModel):
@@ -56,33 +103,116 @@ class SearchCriteria(BaseModel):
     pickup_window_start: str
     pickup_window_end: str
     equipment_type: str
-
-# ---------- Helpers ----------
-def city(s: str) -> str:
-    return s.split(",")[0].strip().lower()
-
-def score(load: dict, crit: SearchCriteria) -> int:
-    s = 0
-    if load["equipment_type"].lower() == crit.equipment_type.lower(): s += 5
-    if city(load["origin"]) == city(crit.origin["city_state"]): s += 3
-    if city(load["destination"]) == city(crit.destination["city_state"]): s += 3
-    ld = datetime.fromisoformat(load["pickup_datetime"])
-    w0 = datetime.fromisoformat(crit.pickup_window_start)
-    w1 = datetime.fromisoformat(crit.pickup_window_end)
-    if w0 <= ld <= w1: s += 2
-    if load.get("miles", 99999) <= 750: s += 1
-    return s
+    # optional: credit loads whose origin/destination is within N miles (origin/destination
+    # may carry "lat"/"lon"; otherwise city_state is geocoded from the bundled gazetteer)
+    origin_radius_miles: float | None = None
+    destination_radius_miles: float | None = None
 
 # ---------- Endpoints ----------
 @app.get("/health")
 def health():
-    return {"ok": True, "time": datetime.now(timezone.utc).isoformat()}
+    return {"ok": True, "time": datetime.now(timezone.utc).isoformat(), "startup": STARTUP}
+
+SEARCH_CACHE = SearchCache(maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "4096")),
+                           ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "600")))
+
+def find_loads(snap, crit: SearchCriteria, k: int = 3) -> tuple:
+    """(top positions, deadhead miles or None) for ``crit`` against one catalog snapshot, cached."""
+    index = snap.index
+    origin_near = dest_near = None
+    if crit.origin_radius_miles:
+        origin_near = index.near(index.origin_grid, geo.point_of(crit.origin), crit.origin_radius_miles)
+    if crit.destination_radius_miles:
+        dest_near = index.near(index.dest_grid, geo.point_of(crit.destination), crit.destination_radius_miles)
+    try:
+        window = epoch(crit.pickup_window_start), epoch(crit.pickup_window_end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search criteria: {e}")
+    args = (crit.origin.get("city_state", ""), crit.destination.get("city_state", ""), crit.equipment_type, *window)
+    key = key_for(index, *args, k, origin_near, dest_near)
+    found = SEARCH_CACHE.get(snap, key)
+    if found is not None:
+        return found
+    with telemetry.timed("search.score"):
+        top = index.top_k(*args, k=k, origin_near=origin_near, dest_near=dest_near)
+    deadhead = None
+    if origin_near is not None:
+        deadhead = [round(origin_near[index.catalog.origin[p]], 1)
+                    if index.catalog.origin[p] in origin_near else None for p in top]
+    found = (top, deadhead)
+    SEARCH_CACHE.put(snap, key, found)
+    return found
 
 @app.post("/search_loads")
 def search_loads(crit: SearchCriteria, x_api_key: str | None = Header(None)):
     require_api_key(x_api_key)
-    ranked = sorted(LOADS, key=lambda L: score(L, crit), reverse=True)
-    return {"loads": ranked[:3]}
+    snap = CATALOG.current
+    top, deadhead = find_loads(snap, crit)
+    out = {"loads": [snap.index.loads[p] for p in top]}
+    if deadhead is not None:
+        out["deadhead_miles"] = deadhead
+    return out
+
+@app.get("/catalog")
+def catalog_status(x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    return {**CATALOG.stats, "search_cache": SEARCH_CACHE.stats()}
+
+class SearchBatch(BaseModel):
+    queries: List[SearchCriteria]
+    k: int = 3
+
+BATCH_MAX_QUERIES = 10000
+
+@app.post("/search_loads/batch")
+def search_loads_batch(batch: SearchBatch, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    if len(batch.queries) > BATCH_MAX_QUERIES or not (1 <= batch.k <= 50):
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries and k in 1..50")
+    if any(q.origin_radius_miles or q.destination_radius_miles for q in batch.queries):
+        raise HTTPException(status_code=400, detail="Radius search is not supported in batch; use /search_loads")
+    index = CATALOG.index
+    try:
+        queries = [(q.origin["city_state"], q.destination["city_state"], q.equipment_type,
+                    epoch(q.pickup_window_start), epoch(q.pickup_window_end)) for q in batch.queries]
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search criteria: {e}")
+    import batch_search  # pulls in NumPy; only paid by the first batch request
+    with telemetry.timed("search.batch_score"):
+        ranked = batch_search.batch_top_k(index, queries, batch.k)
+    return {"results": [{"loads": [index.loads[p] for p in top]} for top in ranked]}
+
+class BackhaulRequest(BaseModel):
+    load_id: str
+    window_hours: float = backhaul.DEFAULT_WINDOW_HOURS
+    max_results: int = 3
+    legs: int = 1  # > 1 also chains multi-leg round trips back to the origin
+    same_equipment_only: bool = False
+
+@app.post("/backhaul")
+def find_backhaul(req: BackhaulRequest, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    index = CATALOG.index
+    pos = index.catalog.position(req.load_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail=f"Unknown load_id: {req.load_id}")
+    if not (0 < req.window_hours <= 72) or not (1 <= req.legs <= 3) or not (1 <= req.max_results <= 20):
+        raise HTTPException(status_code=400, detail="window_hours must be in (0, 72], legs in 1..3, max_results in 1..20")
+    load = index.loads[pos]
+    delivered = datetime.fromisoformat(load["delivery_datetime"])
+    out = {
+        "load_id": req.load_id,
+        "delivery_city": load["destination"],
+        "home": load["origin"],
+        "window_start": delivered.isoformat(),
+        "window_end": (delivered + timedelta(hours=req.window_hours)).isoformat(),
+        "backhauls": backhaul.find_backhauls(index, pos, req.window_hours, req.max_results,
+                                             req.same_equipment_only),
+    }
+    if req.legs > 1:
+        out["round_trips"] = backhaul.round_trips(index, pos, req.window_hours, req.legs,
+                                                  req.max_results, same_equipment_only=req.same_equipment_only)
+    return out
 
 class CounterOffer(BaseModel):
     load_id: str
@@ -109,77 +239,125 @@ def add_hours(payload: AddHoursIn, x_api_key: str | None = Header(None)):
     }
 
 
+def counter_result(catalog, data: CounterOffer, now: float) -> dict:
+    pos = catalog.position(data.load_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail=f"Unknown load_id: {data.load_id}")
+    return negotiation.POLICY.evaluate(catalog.rate[pos], catalog.ceiling_at(pos, now),
+                                       data.carrier_offer, data.round_num)
+
 @app.post("/evaluate_counter")
 async def evaluate_counter(data: CounterOffer, x_api_key: str | None = Header(None)):
     require_api_key(x_api_key)
-    
-    # Get load details
-    load = next(L for L in LOADS if L["load_id"] == data.load_id)
-    lb = float(load["loadboard_rate"])
-
-    # Calculate negotiation ceiling
-    max_bump = lb * 0.12
-    pickup = datetime.fromisoformat(load["pickup_datetime"])
-    now = datetime.now(pickup.tzinfo)
-    if (pickup - now).total_seconds() <= 12 * 3600:
-        max_bump += lb * 0.05
-
-    ceiling = lb + max_bump
-
-    # Decide
-    if data.carrier_offer <= lb:
-        decision = "accept"
-        reason = "At or below listed rate — good margin."
-    elif data.carrier_offer <= ceiling:
-        decision = "accept"
-        reason = "Slightly above listed rate but within allowed bump."
-    else:
-        # Counter logic by round
-        if data.round_num == 1:
-            decision = "counter"
-            broker_offer = lb
-        elif data.round_num == 2:
-            decision = "counter"
-            broker_offer = min(ceiling, lb * 1.05)
-        elif data.round_num == 3:
-            decision = "counter"
-            broker_offer = min(ceiling, lb * 1.08)
-        else:
-            decision = "reject"
-            broker_offer = lb
-        return {
-            "decision": decision,
-            "broker_offer": round(broker_offer, 2),
-            "ceiling": round(ceiling, 2),
-            "listed_rate": lb,
-            "reason": "Counter offer above acceptable ceiling."
-        }
+    return counter_result(CATALOG.catalog, data, time.time())
 
-    return {
-        "decision": decision,
-        "broker_offer": round(data.carrier_offer, 2),
-        "ceiling": round(ceiling, 2),
-        "listed_rate": lb,
-        "reason": reason
-    }
 
+class CounterOfferBatch(BaseModel):
+    offers: List[CounterOffer]
 
-# Setup Table client
-table_service = TableServiceClient.from_connection_string(os.getenv("TABLES_CONN_STRING"))
-table_client = table_service.get_table_client(table_name=os.getenv("TABLE_NAME", "calls"))
+@app.post("/evaluate_counter/batch")
+def evaluate_counter_batch(batch: CounterOfferBatch, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    if len(batch.offers) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} offers per batch")
+    # one catalog version and one clock reading for the whole batch
+    catalog, now = CATALOG.catalog, time.time()
+    results = []
+    for offer in batch.offers:
+        try:
+            results.append(counter_result(catalog, offer, now))
+        except HTTPException as e:
+            results.append({"load_id": offer.load_id, "error": e.detail})
+    return {"results": results}
+
+
+class CallPlanRequest(BaseModel):
+    call_id: str | None = None  # plans are kept per call_id and returned again for the same request
+    criteria: SearchCriteria
+    k: int = 3
+    backhaul_window_hours: float = backhaul.DEFAULT_WINDOW_HOURS
+    backhauls_per_load: int = 3
+
+CALL_PLANS = call_plan.Sessions(maxsize=int(os.getenv("CALL_PLAN_SESSIONS", "10000")),
+                                ttl_seconds=float(os.getenv("CALL_PLAN_TTL_SECONDS", "3600")))
+
+@app.post("/call_plan")
+def build_call_plan(req: CallPlanRequest, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    if not (1 <= req.k <= 10) or not (0 < req.backhaul_window_hours <= 72) or not (0 <= req.backhauls_per_load <= 10):
+        raise HTTPException(status_code=400, detail="k must be in 1..10, backhaul_window_hours in (0, 72], backhauls_per_load in 0..10")
+    snap = CATALOG.current  # search, ladders and backhauls all read this one version
+    key = req.model_dump_json(exclude={"call_id"})
+    if req.call_id:
+        plan = CALL_PLANS.get(req.call_id, key, snap.version)
+        if plan is not None:
+            return plan
+    try:
+        top, deadhead = find_loads(snap, req.criteria, req.k)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search criteria: {e}")
+    with telemetry.timed("call_plan.build"):
+        plan = {"call_id": req.call_id, **call_plan.build_plan(snap, top, deadhead, time.time(),
+                                                                req.backhaul_window_hours, req.backhauls_per_load)}
+    if req.call_id:
+        CALL_PLANS.put(req.call_id, key, plan)
+    return plan
+
+@app.get("/call_plan/{call_id}")
+def get_call_plan(call_id: str, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    plan = CALL_PLANS.get(call_id, version=CATALOG.current.version)  # a plan for an older catalog is stale
+    if plan is None:
+        raise HTTPException(status_code=404, detail=f"No current plan for call_id: {call_id}")
+    return plan
+
+
+# table client is attached by the lifespan
+WRITER = CallLogWriter(None, STORE.insert_calls,
+                       max_queue=int(os.getenv("LOG_QUEUE_MAX", "10000")),
+                       spill_path=os.getenv("LOG_SPILL_PATH", "calls.spill.jsonl"))
+
+RECENT_CALLS = RecentIds(int(os.getenv("RECENT_CALL_IDS", "100000")))
+
+def forget_calls(rows):
+    # the batch never reached SQLite: a retry must be stored, not answered as a duplicate
+    for r in rows:
+        RECENT_CALLS.discard(r[0])
+WRITER.on_error = forget_calls
+
+def row_key(call_id) -> str:
+    # deterministic per call so webhook retries hit the same entity; fall back to
+    # a digest when the id has characters Azure forbids in keys
+    if not call_id:
+        return str(uuid.uuid4())
+    s = str(call_id)
+    if len(s) <= 255 and not any(ch in s for ch in "/\\#?") and s.isprintable():
+        return s
+    return hashlib.sha256(s.encode()).hexdigest()
+
+LIVE = live.Publisher(max_subscribers=int(os.getenv("LIVE_MAX_SUBSCRIBERS", "50")))
+# deltas carry the batch's last call id; a stream drops the ones its snapshot already counted
+WRITER.on_flush = lambda rows: LIVE.publish("delta", rollups.delta(rows), STORE.last_id) if LIVE.subscribers else None
 
 @app.post("/log_call")
 async def log_call(request: Request, x_api_key: str | None = Header(None)):
     require_api_key(x_api_key)
     body = await request.json()
     ext = body.get("extracted", {}) or {}
+    call_id = body.get("call_id")
+
+    # retry of a call this worker just logged: answer without touching storage
+    # (other workers' retries are caught by the unique call_id index and the upsert)
+    if call_id and not RECENT_CALLS.add(call_id):
+        return {"stored": True, "duplicate": True}
 
     # -------------------------
-    # 1) Write to Azure Table Storage
+    # 1) Azure Table Storage entity
     # -------------------------
+    rk = row_key(call_id)
     entity = {
-        "PartitionKey": "CallLogs",
-        "RowKey": str(uuid.uuid4()),  # unique ID
+        "PartitionKey": partitions.partition_key(partitions.CALLS, body.get("timestamp"), rk, CALL_LOG_SHARDS),
+        "RowKey": rk,
         "call_id": body.get("call_id"),
         "timestamp": body.get("timestamp"),
         "outcome": body.get("outcome"),
@@ -197,67 +375,141 @@ async def log_call(request: Request, x_api_key: str | None = Header(None)):
         "miles": ext.get("miles"),
         "loadboard_rate": ext.get("loadboard_rate"),
         "agreed_rate": ext.get("agreed_rate"),
-        "transcript": body.get("transcript"),
     }
-    try:
-        table_client.create_entity(entity=entity)
-    except Exception as e:
-        print("Azure Table insert failed:", e)
+    entities = [entity]
+    if body.get("transcript"):
+        # kept out of the call entity so range reads over CallLogs partitions stay narrow
+        entities.append(partitions.transcript_entity(entity, str(body["transcript"]), CALL_LOG_SHARDS))
 
     # -------------------------
-    # 2) Write to SQLite (for metrics.json)
+    # 2) SQLite row (for metrics.json)
     # -------------------------
-    con = db()
+    row = (
+        body.get("call_id"), body.get("timestamp"), body.get("outcome"),
+        body.get("sentiment"), ext.get("rounds"), ext.get("mc"), ext.get("dot"),
+        ext.get("legal_name"), ext.get("selected_load_id"), ext.get("origin"),
+        ext.get("destination"), ext.get("pickup_datetime"), ext.get("delivery_datetime"),
+        ext.get("equipment_type"), ext.get("miles"), ext.get("loadboard_rate"),
+        ext.get("agreed_rate"), body.get("transcript")
+    )
+
+    # both are written behind the response, batched
     try:
-        con.execute("""
-            INSERT INTO calls (
-                call_id, timestamp, outcome, sentiment, rounds, mc, dot, legal_name,
-                selected_load_id, origin, destination, pickup_datetime, delivery_datetime,
-                equipment_type, miles, loadboard_rate, agreed_rate, transcript
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
-            body.get("call_id"), body.get("timestamp"), body.get("outcome"),
-            body.get("sentiment"), ext.get("rounds"), ext.get("mc"), ext.get("dot"),
-            ext.get("legal_name"), ext.get("selected_load_id"), ext.get("origin"),
-            ext.get("destination"), ext.get("pickup_datetime"), ext.get("delivery_datetime"),
-            ext.get("equipment_type"), ext.get("miles"), ext.get("loadboard_rate"),
-            ext.get("agreed_rate"), body.get("transcript")
-        ))
-        con.commit()
-    except Exception as e:
-        print("SQLite insert failed:", e)
-    finally:
-        con.close()
+        await WRITER.submit(entities, row)
+    except QueueFull:
+        RECENT_CALLS.discard(call_id)  # not logged; let the retry through
+        raise HTTPException(status_code=503, detail="Call log queue is full, retry later")
 
     return {"stored": True}
 
 
+METRICS_CACHE_SECONDS = float(os.getenv("METRICS_CACHE_SECONDS", "2"))
+METRICS_CACHE_MAX = 64
+_metrics_cache = {}  # params -> (computed_at, value)
+
 @app.get("/metrics.json")
-def metrics_json():
-    con = db()
-    # simple aggregates
-    rows = con.execute("SELECT outcome, COUNT(*) c FROM calls GROUP BY outcome").fetchall()
-    by_outcome = {r["outcome"] or "unknown": r["c"] for r in rows}
-    rows = con.execute("SELECT sentiment, COUNT(*) c FROM calls GROUP BY sentiment").fetchall()
-    by_sentiment = {r["sentiment"] or "unknown": r["c"] for r in rows}
-    rows = con.execute("""
-        SELECT substr(timestamp,1,10) d, COUNT(*) c,
-               SUM(CASE WHEN outcome='agreed_and_transferred' THEN 1 ELSE 0 END) won
-        FROM calls GROUP BY d ORDER BY d
-    """).fetchall()
-    daily = [{"date": r["d"], "calls": r["c"], "wins": r["won"]} for r in rows]
-    rows = con.execute("""
-        SELECT equipment_type et, COUNT(*) c FROM calls WHERE equipment_type IS NOT NULL GROUP BY et
-    """).fetchall()
-    by_equipment = {r["et"]: r["c"] for r in rows}
-    rows = con.execute("""
-        SELECT AVG(agreed_rate - loadboard_rate) diff FROM calls 
-        WHERE agreed_rate IS NOT NULL AND loadboard_rate IS NOT NULL
-    """).fetchone()
-    avg_delta = rows["diff"] if rows and rows["diff"] is not None else 0.0
-    con.close()
-    return {"by_outcome": by_outcome, "by_sentiment": by_sentiment,
-            "daily": daily, "by_equipment": by_equipment, "avg_rate_delta": round(avg_delta,2)}
+def metrics_json(from_: str | None = Query(None, alias="from"), to: str | None = None,
+                 granularity: Literal["hour", "day", "week"] | None = None,
+                 origin: str | None = None, destination: str | None = None, mc: str | None = None):
+    ranged = any(v is not None for v in (from_, to, granularity, origin, destination, mc))
+    try:
+        t0 = metrics.parse_time(from_) if from_ else None
+        t1 = metrics.parse_time(to) if to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid from/to. Use ISO 8601 or a look-back like 24h, 7d")
+    # keyed by the raw params, so a look-back like 24h is shared for the TTL
+    key = (from_, to, granularity, origin, destination, mc)
+    now = time.monotonic()
+    hit = _metrics_cache.get(key)
+    if hit is not None and now - hit[0] <= METRICS_CACHE_SECONDS:
+        return hit[1]
+    with STORE.reader() as con:
+        con.execute("BEGIN")  # one snapshot for all aggregates
+        if ranged:
+            # archived days in range contribute their stored aggregates
+            with telemetry.timed("metrics.range"):
+                value = metrics.range_metrics(con, t0, t1, granularity or "day", origin, destination, mc,
+                                              archived=ARCHIVE.metric_parts(t0, t1, origin, destination, mc))
+        else:
+            with telemetry.timed("metrics.rollup"):
+                value = rollups.read_metrics(con)
+    if len(_metrics_cache) >= METRICS_CACHE_MAX:
+        _metrics_cache.clear()
+    _metrics_cache[key] = (now, value)
+    return value
+
+@app.get("/calls/export")
+def export_calls(format: Literal["ndjson", "csv"] = "ndjson", from_: str | None = Query(None, alias="from"),
+                 to: str | None = None, columns: str | None = None, after_id: int = 0,
+                 until_id: int | None = None, gzip: bool = False, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    try:
+        t0 = metrics.parse_time(from_) if from_ else None
+        t1 = metrics.parse_time(to) if to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid from/to. Use ISO 8601 or a look-back like 24h, 7d")
+    try:
+        cols = export.select_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start, end = export.id_bounds(STORE, t0, t1, after_id)
+    archived = ARCHIVE.id_bounds(t0, t1, after_id)
+    if archived is not None:
+        start, end = min(start, archived[0]), max(end, archived[1])
+    if until_id is not None:
+        end = min(end, until_id)
+    # pass X-Export-Until-Id back with after_id=<last id received> to resume the same export
+    headers = {"X-Export-Until-Id": str(end),
+               "Content-Disposition": f'attachment; filename="calls.{format}{".gz" if gzip else ""}"'}
+    archived = ARCHIVE.rows(cols, start, end, t0, t1) if archived is not None else None
+    # a .gz download, not Content-Encoding: clients would decode that and save plain text as .gz
+    return StreamingResponse(export.stream(STORE, format, cols, start, end, t0, t1, gzip, archived),
+                             media_type="application/gzip" if gzip else export.MEDIA_TYPES[format], headers=headers)
+
+def read_rollups() -> dict:
+    with STORE.reader() as con:
+        con.execute("BEGIN")
+        seq = con.execute("SELECT seq FROM sqlite_sequence WHERE name = 'calls'").fetchone()
+        return {**rollups.read_metrics(con), "seq": seq[0] if seq else 0}
+
+async def rollup_snapshot() -> dict:
+    return await asyncio.to_thread(read_rollups)
+
+@app.get("/metrics/stream")
+async def metrics_stream():
+    try:
+        q = LIVE.subscribe()
+    except live.TooManySubscribers as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(live.stream(LIVE, q, rollup_snapshot), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- Service telemetry ----------
+telemetry.gauge("catalog_loads", "Loads in the live catalog snapshot.", lambda: CATALOG.stats["loads"])
+telemetry.gauge("catalog_version", "Catalog snapshot version.", lambda: CATALOG.stats["version"])
+telemetry.gauge("catalog_reload_errors", "Failed catalog reloads since start.", lambda: CATALOG.stats["errors"])
+telemetry.gauge("call_log_queue_depth", "Call logs waiting for the write-behind flusher.", WRITER.depth)
+telemetry.gauge("call_log_writer", "Write-behind counters since start.", lambda: WRITER.stats, label="counter")
+telemetry.gauge("recent_call_ids", "Call-id dedupe LRU lookups (hits are dropped retries).",
+                lambda: RECENT_CALLS.stats, label="result")
+telemetry.gauge("search_cache", "Search result cache counters and size.",
+                lambda: {k: v for k, v in SEARCH_CACHE.stats().items() if k != "maxsize"}, label="stat")
+telemetry.gauge("call_retention", "Retention job counters since start.",
+                lambda: {k: v for k, v in RETENTION.stats.items() if k != "last_error"}, label="counter")
+telemetry.gauge("call_plan_sessions", "Call plans kept for reuse by call_id.", lambda: len(CALL_PLANS))
+telemetry.gauge("live_subscribers", "Open /metrics/stream connections.", lambda: len(LIVE.subscribers))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile/{profile_id}", response_class=PlainTextResponse)
+def debug_profile(profile_id: str, x_api_key: str | None = Header(None)):
+    require_api_key(x_api_key)
+    folded = telemetry.get_profile(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired profile id")
+    return folded
 
 # lightweight HTML dashboard
 DASH_HTML = """
@@ -269,27 +521,51 @@ DASH_HTML = """
 <p>Avg agreed - listed delta: <span id="delta"></span></p>
 <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
 <script>
-async function load(){
-  const r = await fetch('/metrics.json'); const m = await r.json();
-  document.getElementById('delta').textContent = '$' + m.avg_rate_delta;
-  // daily
-  new Chart(document.getElementById('c1'), {
-    type: 'line', data: { labels: m.daily.map(x=>x.date),
-    datasets: [{ label:'Calls', data:m.daily.map(x=>x.calls) },
-               { label:'Wins', data:m.daily.map(x=>x.wins) }] }
-  });
-  // by outcome
-  new Chart(document.getElementById('c2'), {
-    type: 'bar', data: { labels: Object.keys(m.by_outcome),
-    datasets: [{ label:'Calls', data:Object.values(m.by_outcome) }] }
-  });
-  // by sentiment
-  new Chart(document.getElementById('c3'), {
-    type: 'bar', data: { labels: Object.keys(m.by_sentiment),
-    datasets: [{ label:'Calls', data:Object.values(m.by_sentiment) }] }
-  });
+// one snapshot on connect, then deltas pushed per committed batch; charts update in place
+const state = {};
+const charts = {
+  daily: new Chart(document.getElementById('c1'), { type: 'line',
+    data: { labels: [], datasets: [{ label:'Calls', data:[] }, { label:'Wins', data:[] }] } }),
+  outcome: new Chart(document.getElementById('c2'), { type: 'bar',
+    data: { labels: [], datasets: [{ label:'Calls', data:[] }] } }),
+  sentiment: new Chart(document.getElementById('c3'), { type: 'bar',
+    data: { labels: [], datasets: [{ label:'Calls', data:[] }] } }),
+};
+function add(into, from){ for (const k in from) into[k] = (into[k] || 0) + from[k]; }
+function setBars(chart, counts){
+  chart.data.labels = Object.keys(counts);
+  chart.data.datasets[0].data = Object.values(counts);
+  chart.update('none');
+}
+function render(){
+  const days = Object.keys(state.daily).sort();
+  charts.daily.data.labels = days;
+  charts.daily.data.datasets[0].data = days.map(d=>state.daily[d].calls);
+  charts.daily.data.datasets[1].data = days.map(d=>state.daily[d].wins);
+  charts.daily.update('none');
+  setBars(charts.outcome, state.by_outcome);
+  setBars(charts.sentiment, state.by_sentiment);
+  const r = state.rate_delta;
+  document.getElementById('delta').textContent = '$' + (r.calls ? r.total / r.calls : 0).toFixed(2);
+}
+function snapshot(m){
+  state.by_outcome = m.by_outcome; state.by_sentiment = m.by_sentiment;
+  state.rate_delta = m.rate_delta; state.daily = {};
+  for (const x of m.daily) state.daily[x.date] = { calls:x.calls, wins:x.wins };
+  render();
+}
+function delta(d){
+  add(state.by_outcome, d.by_outcome); add(state.by_sentiment, d.by_sentiment);
+  for (const x of d.daily) {
+    const day = state.daily[x.date] = state.daily[x.date] || { calls:0, wins:0 };
+    day.calls += x.calls; day.wins += x.wins;
+  }
+  state.rate_delta.calls += d.rate_delta.calls; state.rate_delta.total += d.rate_delta.total;
+  render();
 }
-load();
+const es = new EventSource('/metrics/stream');
+es.addEventListener('snapshot', e => snapshot(JSON.parse(e.data)));
+es.addEventListener('delta', e => { if (state.daily) delta(JSON.parse(e.data)); });
 </script>
 """
 @app.get("/dashboard", response_class=HTMLResponse)
@@ -0,0 +1,242 @@
+"""Retention: roll old days of call logs out of SQLite into compressed archive files.
+
+The ``calls`` table used to grow without limit. ``run`` moves every UTC
+day older than ``keep_days`` (by ``ts``) into
+
+    <archive dir>/calls-YYYY-MM-DD.ndjson.gz    every column, one row per line, in id order
+    <archive dir>/index.json                    {day: {file, rows, min_id, max_id, metrics, deleted}}
+
+and then deletes those rows and their transcripts from SQLite. Each file is
+fsynced and swapped in with ``os.replace`` before any row is deleted, and its
+index entry says ``deleted: false`` until the delete has committed. A crash
+in between leaves rows in both places; ``reconcile`` (at app startup and at
+the start of every run) finishes those deletes before archived and live rows
+are merged again. Runs are serialized across workers with an ``flock``. Calls
+with no parseable timestamp are never archived.
+
+Archived calls stay readable:
+
+* all-time ``/metrics.json`` comes from the rollup tables, which deletes
+  never touch;
+* ranged ``/metrics.json`` merges ``metric_parts``: each archived day's
+  ``metrics`` (a ``metrics.part_of`` computed when it was archived) when
+  the range covers the whole day, and only for a day cut by the range or
+  by a lane / carrier filter that occurs in it are rows read back;
+* ``/calls/export`` merges ``rows`` (archived, id order) with the live
+  pages, so ids and resume tokens work across the boundary.
+
+    python archive.py run [calls.db] [archive dir] [keep days]
+"""
+import fcntl, gzip, heapq, json, os, sys, threading, time
+from datetime import datetime, timezone
+
+import export, metrics
+
+DAY = 86400
+INDEX = "index.json"
+
+
+def day_name(day: int) -> str:
+    return datetime.fromtimestamp(day, timezone.utc).date().isoformat()
+
+
+def day_start(name: str) -> int:
+    return int(datetime.fromisoformat(name).replace(tzinfo=timezone.utc).timestamp())
+
+
+class Archive:
+    def __init__(self, path: str):
+        self.path = path
+        self._index, self._index_fp = {}, None
+
+    # ---------- index ----------
+    def index(self) -> dict:
+        """{day: entry}, re-read only when another process rewrote it."""
+        try:
+            st = os.stat(os.path.join(self.path, INDEX))
+        except FileNotFoundError:
+            return {}
+        fp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if fp != self._index_fp:
+            with open(os.path.join(self.path, INDEX)) as f:
+                self._index, self._index_fp = json.load(f), fp
+        return self._index
+
+    def _write_index(self, index: dict):
+        self._write_atomic(INDEX, json.dumps(index, indent=1, sort_keys=True).encode())
+
+    def _write_atomic(self, name: str, data: bytes):
+        tmp = os.path.join(self.path, f"{name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, name))
+
+    def days(self, t0: int = None, t1: int = None) -> list:
+        """Archived days overlapping [t0, t1), oldest first."""
+        return [d for d in sorted(self.index())
+                if (t1 is None or day_start(d) < t1) and (t0 is None or day_start(d) + DAY > t0)]
+
+    # ---------- reading ----------
+    def _read_day(self, day: str):
+        with gzip.open(os.path.join(self.path, self.index()[day]["file"]), "rt") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def rows(self, columns: list, after_id: int, until_id: int, t0: int = None, t1: int = None):
+        """Archived row tuples for ``after_id < id <= until_id`` in [t0, t1), merged into id order."""
+        index = self.index()
+        days = [d for d in self.days(t0, t1)
+                if index[d]["max_id"] > after_id and index[d]["min_id"] <= until_id]
+
+        def day_rows(day):
+            for r in self._read_day(day):
+                if after_id < r["id"] <= until_id and (t0 is None or r["ts"] >= t0) and (t1 is None or r["ts"] < t1):
+                    yield tuple(r[c] for c in columns)
+
+        return heapq.merge(*(day_rows(d) for d in days), key=lambda r: r[0])
+
+    def id_bounds(self, t0: int = None, t1: int = None, after_id: int = 0):
+        """(first id - 1, last id) of the archived days in range, like ``export.id_bounds``; None if none."""
+        index = self.index()
+        days = self.days(t0, t1)
+        if not days:
+            return None
+        return (max(after_id, min(index[d]["min_id"] for d in days) - 1),
+                max(index[d]["max_id"] for d in days))
+
+    def metric_parts(self, t0: int = None, t1: int = None, origin: str = None, destination: str = None,
+                     mc: str = None) -> list:
+        """``metrics`` parts for the archived calls in [t0, t1) matching the filters."""
+        index = self.index()
+        filters = {k: v for k, v in (("origin", origin), ("destination", destination), ("mc", mc)) if v is not None}
+        parts = []
+        for day in self.days(t0, t1):
+            part, start = index[day].get("metrics"), day_start(day)
+            whole = (t0 is None or t0 <= start) and (t1 is None or start + DAY <= t1)
+            if part is not None and whole and not filters:
+                parts.append(part)
+                continue
+            if part is not None and not self._may_match(part, filters):
+                continue
+            parts.append(metrics.part_of(
+                r for r in self._read_day(day) if (t0 is None or r["ts"] >= t0) and (t1 is None or r["ts"] < t1)
+                and all(r[k] == v for k, v in filters.items())))
+        return parts
+
+    @staticmethod
+    def _may_match(part: dict, filters: dict) -> bool:
+        """False when the day has no call on the filtered lane / carrier, so its file need not be read."""
+        if "mc" in filters and not any(c[0] == filters["mc"] for c in part["carriers"]):
+            return False
+        return any(filters.get("origin", o) == o and filters.get("destination", d) == d
+                   for o, d, *_ in part["lanes"])
+
+    # ---------- retention ----------
+    def reconcile(self, store) -> list:
+        """Finish the deletes a crash interrupted; returns the days whose rows were still in SQLite."""
+        if not self._pending():
+            return []
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            return self._finish_deletes(store)
+
+    def _pending(self) -> list:
+        return [d for d, e in self.index().items() if not e.get("deleted", True)]
+
+    def _finish_deletes(self, store) -> list:
+        pending = self._pending()
+        for name in pending:
+            self._delete_day(store, name, self.index()[name]["max_id"])
+        return pending
+
+    def _delete_day(self, store, name: str, end: int):
+        # every row of the day up to ``end`` is in the file; ids above it arrived after the read
+        day = day_start(name)
+        with store.transaction() as con:
+            where = "ts >= ? AND ts < ? AND id <= ?"
+            con.execute(f"DELETE FROM transcripts WHERE call_row IN (SELECT id FROM calls WHERE {where})",
+                        (day, day + DAY, end))
+            con.execute(f"DELETE FROM calls WHERE {where}", (day, day + DAY, end))
+        self._write_index({**self.index(), name: {**self.index()[name], "deleted": True}})
+
+    def run(self, store, keep_days: int, now: float = None) -> list:
+        """Archive every UTC day that ended more than ``keep_days`` ago; returns the index entries written."""
+        now = time.time() if now is None else now
+        cutoff = int(now // DAY - keep_days) * DAY
+        os.makedirs(self.path, exist_ok=True)
+        done = []
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # one archiver at a time across workers
+            self._finish_deletes(store)
+            days = [r[0] for r in store.query(
+                f"SELECT DISTINCT ts - ts % {DAY} FROM calls WHERE ts < ? ORDER BY 1", [cutoff])]
+            for day in days:
+                done.append(self._archive_day(store, day))
+        return done
+
+    def _archive_day(self, store, day: int) -> dict:
+        name = day_name(day)
+        start, end = export.id_bounds(store, day, day + DAY)
+        rows = {}
+        for page in export.rows(store, export.COLUMNS, start, end, day, day + DAY):
+            rows.update((r[0], dict(zip(export.COLUMNS, r))) for r in page)
+        if name in self.index():  # late rows for a day already archived: merge
+            rows.update((r["id"], r) for r in self._read_day(name) if r["id"] not in rows)
+        ordered = [rows[i] for i in sorted(rows)]
+        body = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in ordered).encode()
+        entry = {"file": f"calls-{name}.ndjson.gz", "rows": len(ordered),
+                 "min_id": ordered[0]["id"], "max_id": ordered[-1]["id"], "metrics": metrics.part_of(ordered),
+                 "deleted": False}
+        self._write_atomic(entry["file"], gzip.compress(body, 6))
+        self._write_index({**self.index(), name: entry})
+        # only now is it safe to drop the rows
+        self._delete_day(store, name, end)
+        return {"day": name, **{k: v for k, v in entry.items() if k not in ("metrics", "deleted")}}
+
+
+class Retention:
+    """Background thread that runs ``Archive.run`` every ``interval`` seconds."""
+
+    def __init__(self, archive: Archive, store, keep_days: int, interval: float = 3600.0):
+        self.archive, self.store = archive, store
+        self.keep_days, self.interval = keep_days, interval
+        self.stats = {"runs": 0, "days_archived": 0, "rows_archived": 0, "errors": 0, "last_error": None}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.keep_days > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="call-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                done = self.archive.run(self.store, self.keep_days)
+                self.stats["runs"] += 1
+                self.stats["days_archived"] += len(done)
+                self.stats["rows_archived"] += sum(d["rows"] for d in done)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = repr(e)
+                print("Call log archival failed:", e)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "run":
+        sys.exit("usage: python archive.py run [db_path] [archive dir] [keep days]")
+    from store import CallStore
+    store = CallStore(sys.argv[2] if len(sys.argv) > 2 else os.getenv("DB_PATH", "calls.db"))
+    store.init_schema()
+    arch = Archive(sys.argv[3] if len(sys.argv) > 3 else os.getenv("ARCHIVE_DIR", "archive"))
+    for entry in arch.run(store, int(sys.argv[4] if len(sys.argv) > 4 else os.getenv("RETENTION_DAYS", "90"))):
+        print(f"{entry['day']}: {entry['rows']} calls -> {entry['file']}")
+    store.close()
@@ -0,0 +1,80 @@
+"""Backhaul finder.
+
+Given the load a carrier just booked, find loads departing its delivery city
+within a pickup window after delivery (10 hours by default), preferring
+ones that head back to the original origin and use the same equipment.
+Candidates come straight from the per-origin-city departure index
+(``LoadIndex.departures``), a binary-search range query, so the cost
+depends on how many loads leave that city inside the window, not on the
+catalog size.
+"""
+from search import LoadIndex
+
+DEFAULT_WINDOW_HOURS = 10
+
+
+def rank(index: LoadIndex, after: int, home: int, equip: int, window_seconds: float) -> list:
+    """Positions departing ``after``'s delivery city in the window, best first."""
+    c = index.catalog
+    t = c.delivery[after]
+    cands = [p for p in index.departures(c.dest[after], t, t + window_seconds) if p != after]
+    # back home first, then same equipment, then the shortest wait (departures are time-ordered)
+    cands.sort(key=lambda p: (c.dest[p] != home, c.equip[p] != equip))
+    return cands
+
+
+def describe(index: LoadIndex, pos: int, after: int, home: int, equip: int) -> dict:
+    c = index.catalog
+    return {"load": index.loads[pos],
+            "returns_home": c.dest[pos] == home,
+            "same_equipment": c.equip[pos] == equip,
+            "wait_hours": round((c.pickup[pos] - c.delivery[after]) / 3600, 2)}
+
+
+def find_backhauls(index: LoadIndex, pos: int, window_hours: float = DEFAULT_WINDOW_HOURS,
+                   k: int = 3, same_equipment_only: bool = False) -> list:
+    c = index.catalog
+    home, equip = c.origin[pos], c.equip[pos]
+    cands = rank(index, pos, home, equip, window_hours * 3600)
+    if same_equipment_only:
+        cands = [p for p in cands if c.equip[p] == equip]
+    return [describe(index, p, pos, home, equip) for p in cands[:k]]
+
+
+def round_trips(index: LoadIndex, pos: int, window_hours: float = DEFAULT_WINDOW_HOURS,
+                max_legs: int = 2, k: int = 3, beam: int = 5, same_equipment_only: bool = False) -> list:
+    """Chains of up to ``max_legs`` loads that bring the truck back to the origin.
+
+    Each hop expands only the ``beam`` best departures, so the search stays
+    bounded at beam ** max_legs window lookups.
+    """
+    c = index.catalog
+    home, equip = c.origin[pos], c.equip[pos]
+    window = window_hours * 3600
+    found = []
+
+    def extend(chain):
+        last = chain[-1]
+        cands = rank(index, last, home, equip, window)
+        if same_equipment_only:
+            cands = [p for p in cands if c.equip[p] == equip]
+        for p in cands[:beam]:
+            if p in chain:
+                continue
+            if c.dest[p] == home:
+                found.append(chain[1:] + [p])
+            elif len(chain) < max_legs:
+                extend(chain + [p])
+
+    extend([pos])
+    # fewest legs, then least total time from first delivery to getting home
+    found.sort(key=lambda legs: (len(legs), c.delivery[legs[-1]]))
+    trips = []
+    for legs in found[:k]:
+        prev, steps = pos, []
+        for p in legs:
+            steps.append(describe(index, p, prev, home, equip)); prev = p
+        trips.append({"legs": steps, "legs_count": len(legs),
+                      "total_wait_hours": round(sum(s["wait_hours"] for s in steps), 2),
+                      "home_at": index.loads[legs[-1]]["delivery_datetime"]})
+    return trips
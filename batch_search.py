@@ -0,0 +1,130 @@
+"""Vectorized batch search for /search_loads/batch.
+
+Lane-planning tools and replay tests send thousands of criteria at once.
+Instead of running the per-query index walk thousands of times, the catalog
+is copied once per catalog version into NumPy columns (integer place and
+equipment codes, int64 pickup times) and each chunk of queries is scored as
+one (queries x loads) matrix. The ranking is the same as
+``LoadIndex.top_k``: score descending, catalog position ascending.
+
+Parity check against the original scorer (``search.score``) over the raw load dicts:
+
+    python batch_search.py [loads.json] [n_queries]
+"""
+import numpy as np
+
+from search import LoadIndex, W_DEST, W_EQUIP, W_ORIGIN, W_WINDOW
+
+MATRIX_CELLS = 4_000_000  # per chunk; bounds temporary memory to a few tens of MB
+
+
+def _column(col, dtype):
+    a = np.frombuffer(col, dtype=dtype)
+    # columns of a mapped catalog file are read-only and shared between workers: use them in place
+    return a if isinstance(col, memoryview) else a.copy()
+
+
+class Columns:
+    """NumPy view (mapped catalogs) or copy of one catalog version."""
+
+    def __init__(self, index: LoadIndex):
+        c = index.catalog
+        self.index = index
+        self.n = len(c)
+        self.origin = _column(c.origin, np.int32)
+        self.dest = _column(c.dest, np.int32)
+        self.equip = _column(c.equip, np.int32)
+        self.pickup = _column(c.pickup, np.int64)
+        # static part of the score; tombstoned rows can never rank
+        self.base = np.frombuffer(bytes(index.short), dtype=np.int8).astype(np.int64)
+        if index.dead:
+            self.base[list(index.dead)] = -100
+        # tie-break: earlier catalog position wins
+        self.tiebreak = np.arange(self.n - 1, -1, -1, dtype=np.int64)
+
+
+_cached = None
+
+
+def columns(index: LoadIndex) -> Columns:
+    global _cached
+    cols = _cached
+    if cols is None or cols.index is not index:
+        cols = _cached = Columns(index)
+    return cols
+
+
+def _places(c, cities: list) -> np.ndarray:
+    """(queries x places) codes of every place with each query's city name, padded with -1."""
+    named = [c.places_named(s) for s in cities]
+    out = np.full((len(named), max(1, *map(len, named))), -1, dtype=np.int32)
+    for i, ps in enumerate(named):
+        out[i, :len(ps)] = ps
+    return out
+
+
+def _matches(col: np.ndarray, places: np.ndarray) -> np.ndarray:
+    # matching is by city name, which may cover several places; compare codes, never copy the column
+    m = col == places[:, :1]
+    for j in range(1, places.shape[1]):
+        m |= col == places[:, j:j + 1]
+    return m
+
+
+def batch_top_k(index: LoadIndex, queries: list, k: int = 3) -> list:
+    """``queries``: (origin, destination, equipment, t0, t1) tuples. Returns position lists."""
+    cols = columns(index)
+    if not queries or cols.n == 0 or k <= 0:
+        return [[] for _ in queries]
+    c, n = index.catalog, cols.n
+    o, d = _places(c, [q[0] for q in queries]), _places(c, [q[1] for q in queries])
+    e = np.array([c.equip_code(q[2]) for q in queries], dtype=np.int32)
+    t0 = np.array([q[3] for q in queries], dtype=np.float64)
+    t1 = np.array([q[4] for q in queries], dtype=np.float64)
+    k = min(k, n - len(index.dead))
+    out = []
+    step = max(1, MATRIX_CELLS // n)
+    for s in range(0, len(queries), step):
+        sl = slice(s, s + step)
+        score = cols.base + W_EQUIP * (cols.equip == e[sl, None])
+        score += W_ORIGIN * _matches(cols.origin, o[sl])
+        score += W_DEST * _matches(cols.dest, d[sl])
+        score += W_WINDOW * ((cols.pickup >= t0[sl, None]) & (cols.pickup <= t1[sl, None]))
+        key = score * n + cols.tiebreak
+        if k < n:
+            top = np.argpartition(key, n - k, axis=1)[:, n - k:]
+        else:
+            top = np.broadcast_to(np.arange(n), key.shape)
+        order = np.take_along_axis(key, top, axis=1).argsort(axis=1)[:, ::-1]
+        out.extend(np.take_along_axis(top, order, axis=1).tolist())
+    return out
+
+
+if __name__ == "__main__":
+    import json, random, sys
+    from datetime import datetime, timezone
+    from catalog import Catalog
+    from search import score
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "loads.json"
+    nq = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    with open(path) as f:
+        index = LoadIndex(Catalog(json.load(f)))
+    c = index.catalog
+    cities = [s.title() for s in c.places] + ["Nowhere"]
+    equipment = list(c.equipment) + ["tanker"]
+    lo, hi = min(c.pickup), max(c.pickup)
+    rnd = random.Random(0)
+    queries = []
+    for _ in range(nq):
+        t0 = rnd.randint(lo - 86400, hi)
+        queries.append((rnd.choice(cities), rnd.choice(cities), rnd.choice(equipment),
+                        t0, t0 + rnd.choice([0, 3600, 86400, 7 * 86400])))
+    got = batch_top_k(index, queries, 3)
+    bad = 0
+    for q, g in zip(queries, got):
+        w0, w1 = (datetime.fromtimestamp(t, timezone.utc) for t in q[3:])
+        ref = sorted(c.sources, key=lambda L: -score(L, q[0], q[1], q[2], w0, w1))[:3]
+        bad += ref != [index.loads[p] for p in g]
+    print(f"{nq} queries over {len(c)} loads: {bad} mismatches")
+    sys.exit(1 if bad else 0)
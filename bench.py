@@ -0,0 +1,236 @@
+"""Load-generation benchmark for the carrier API.
+
+Starts the app in-process on localhost (``LOCAL_MODE``: in-memory Azure
+Table stand-in, SQLite in a temp dir), generates synthetic catalogs of
+the requested sizes, and drives concurrent async traffic at /search_loads,
+/evaluate_counter, /log_call and /metrics.json. Reports p50/p95/p99 latency,
+throughput and memory per catalog size and writes everything to JSON so
+runs can be diffed.
+
+    pip install -r requirements-dev.txt
+    python bench.py --sizes 1000,10000,100000 --requests 2000 --concurrency 32
+    python bench.py --compare bench_results/old.json bench_results/new.json
+
+``--url`` points the traffic at an already running server instead (catalog
+size and storage are then whatever that server has).
+"""
+import argparse, asyncio, json, os, random, resource, socket, sys, tempfile, threading, time, uuid
+from datetime import datetime, timedelta, timezone
+
+API_KEY = "bench-key"
+EQUIPMENT = ["Dry Van", "Reefer", "Flatbed", "Step Deck", "Power Only"]
+MIX = {"search_loads": 0.45, "evaluate_counter": 0.30, "log_call": 0.20, "metrics": 0.05}
+
+
+# ---------- synthetic data ----------
+def gen_catalog(n: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.json")) as f:
+        cities = list(json.load(f))
+    base = datetime(2025, 8, 15, tzinfo=timezone.utc)
+    loads = []
+    for i in range(n):
+        o, d = rnd.sample(cities, 2)
+        pickup = base + timedelta(minutes=30 * rnd.randint(0, 14 * 48))
+        miles = rnd.randint(80, 2400)
+        loads.append({
+            "load_id": f"SYN-{i:07d}", "origin": o, "destination": d,
+            "pickup_datetime": pickup.isoformat(),
+            "delivery_datetime": (pickup + timedelta(hours=miles / 50 + 2)).isoformat(),
+            "equipment_type": rnd.choice(EQUIPMENT),
+            "loadboard_rate": round(miles * rnd.uniform(1.6, 3.2), 2),
+            "notes": "", "weight": rnd.randint(8000, 44000), "commodity_type": "General",
+            "num_of_pieces": rnd.randint(1, 30), "miles": miles, "dimensions": "53'x102\"",
+        })
+    return loads
+
+
+def search_body(rnd, loads) -> dict:
+    L = rnd.choice(loads)
+    t = datetime.fromisoformat(L["pickup_datetime"]) - timedelta(hours=rnd.randint(0, 24))
+    return {"origin": {"city_state": L["origin"]}, "destination": {"city_state": L["destination"]},
+            "pickup_window_start": t.isoformat(), "pickup_window_end": (t + timedelta(hours=48)).isoformat(),
+            "equipment_type": rnd.choice(EQUIPMENT)}
+
+
+def counter_body(rnd, loads) -> dict:
+    L = rnd.choice(loads)
+    return {"load_id": L["load_id"], "carrier_offer": round(L["loadboard_rate"] * rnd.uniform(0.9, 1.3), 2),
+            "round_num": rnd.randint(1, 4)}
+
+
+def log_body(rnd, loads) -> dict:
+    L = rnd.choice(loads)
+    won = rnd.random() < 0.35
+    return {"call_id": str(uuid.uuid4()), "timestamp": datetime.now(timezone.utc).isoformat(),
+            "outcome": "agreed_and_transferred" if won else rnd.choice(["counter_declined", "no_match"]),
+            "sentiment": rnd.choice(["positive", "neutral", "negative"]),
+            "extracted": {"rounds": rnd.randint(1, 3), "mc": str(rnd.randint(100000, 999999)),
+                          "dot": str(rnd.randint(1000000, 9999999)), "legal_name": "Bench Freight LLC",
+                          "selected_load_id": L["load_id"], "origin": L["origin"],
+                          "destination": L["destination"], "pickup_datetime": L["pickup_datetime"],
+                          "delivery_datetime": L["delivery_datetime"], "equipment_type": L["equipment_type"],
+                          "miles": L["miles"], "loadboard_rate": L["loadboard_rate"],
+                          "agreed_rate": L["loadboard_rate"] + 50 if won else None},
+            "transcript": "x" * rnd.randint(200, 4000)}
+
+
+# ---------- in-process server ----------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(workdir: str, loads_path: str):
+    os.environ.update(API_KEY=API_KEY, LOADS_PATH=loads_path, DB_PATH=os.path.join(workdir, "calls.db"),
+                      LOG_SPILL_PATH=os.path.join(workdir, "spill.jsonl"), CATALOG_POLL_SECONDS="0",
+                      METRICS_CACHE_SECONDS=os.getenv("METRICS_CACHE_SECONDS", "2"),
+                      LOCAL_MODE="1", CATALOG_SNAPSHOT_PATH="")  # in-memory table client, always a full build
+    import uvicorn
+    import app as api
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return api, server, thread, f"http://127.0.0.1:{port}"
+
+
+# ---------- traffic ----------
+def percentiles(xs: list) -> dict:
+    if not xs:
+        return {}
+    xs = sorted(xs)
+    pick = lambda q: xs[min(len(xs) - 1, int(q * len(xs)))]
+    return {"count": len(xs), "mean_ms": round(sum(xs) / len(xs), 3), "p50_ms": round(pick(0.50), 3),
+            "p95_ms": round(pick(0.95), 3), "p99_ms": round(pick(0.99), 3), "max_ms": round(xs[-1], 3)}
+
+
+async def drive(url: str, loads: list, requests: int, concurrency: int, seed: int) -> dict:
+    import httpx
+    rnd = random.Random(seed)
+    kinds = rnd.choices(list(MIX), weights=list(MIX.values()), k=requests)
+    lat = {k: [] for k in MIX}
+    errors = {k: 0 for k in MIX}
+    headers = {"x-api-key": API_KEY}
+    queue = asyncio.Queue()
+    for k in kinds:
+        queue.put_nowait(k)
+
+    async def worker(client):
+        while True:
+            try:
+                kind = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if kind == "search_loads":
+                req = client.post("/search_loads", json=search_body(rnd, loads), headers=headers)
+            elif kind == "evaluate_counter":
+                req = client.post("/evaluate_counter", json=counter_body(rnd, loads), headers=headers)
+            elif kind == "log_call":
+                req = client.post("/log_call", json=log_body(rnd, loads), headers=headers)
+            else:
+                req = client.get("/metrics.json")
+            t = time.perf_counter()
+            try:
+                r = await req
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            lat[kind].append((time.perf_counter() - t) * 1000)
+            errors[kind] += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return {"elapsed_s": round(elapsed, 3), "throughput_rps": round(requests / elapsed, 1),
+            "endpoints": {k: dict(percentiles(v), errors=errors[k]) for k, v in lat.items() if v}}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except OSError:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run(args) -> dict:
+    result = {"started_at": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0],
+              "requests": args.requests, "concurrency": args.concurrency, "runs": []}
+    workdir = tempfile.mkdtemp(prefix="carrier-bench-")
+    api = server = thread = None
+    for n in [int(s) for s in args.sizes.split(",")]:
+        loads = gen_catalog(n, args.seed)
+        path = os.path.join(workdir, f"loads-{n}.json")
+        with open(path, "w") as f:
+            json.dump(loads, f)
+        run = {"loads": n}
+        if args.url:
+            url = args.url
+        elif api is None:
+            rss0 = rss_mb()
+            t = time.perf_counter()
+            api, server, thread, url = start_app(workdir, path)
+            run["startup_s"] = round(time.perf_counter() - t, 3)
+            run["catalog_rss_mb"] = round(rss_mb() - rss0, 1)
+        else:
+            from catalog_manager import FileSource
+            rss0 = rss_mb()
+            api.CATALOG.source = FileSource(path)
+            api.CATALOG.reload(force=True)
+            run["catalog_rss_mb"] = round(rss_mb() - rss0, 1)
+        if api is not None:
+            run["catalog_build_ms"] = api.CATALOG.stats["build_ms"]
+        run.update(asyncio.run(drive(url, loads, args.requests, args.concurrency, args.seed)))
+        run["rss_mb"] = rss_mb()
+        result["runs"].append(run)
+        print(f"{n:>9} loads  {run['throughput_rps']:>8} req/s  " + "  ".join(
+            f"{k} p50={v['p50_ms']} p99={v['p99_ms']}" for k, v in run["endpoints"].items()))
+        del loads
+    if server is not None:
+        server.should_exit = True
+        thread.join(timeout=10)
+    result["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = {r["loads"]: r for r in json.load(f)["runs"]}
+    with open(new_path) as f:
+        new = {r["loads"]: r for r in json.load(f)["runs"]}
+    for n in sorted(old.keys() & new.keys()):
+        a, b = old[n], new[n]
+        print(f"{n} loads: throughput {a['throughput_rps']} -> {b['throughput_rps']} req/s")
+        for ep in sorted(a["endpoints"].keys() & b["endpoints"].keys()):
+            for q in ("p50_ms", "p95_ms", "p99_ms"):
+                x, y = a["endpoints"][ep][q], b["endpoints"][ep][q]
+                change = (y - x) / x * 100 if x else 0.0
+                flag = "  REGRESSION" if change > 10 else ""
+                print(f"  {ep:<17} {q}: {x:>9} -> {y:>9} ({change:+.1f}%){flag}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--sizes", default="1000,10000,100000", help="comma-separated catalog sizes (up to 1000000)")
+    ap.add_argument("--requests", type=int, default=2000, help="requests per catalog size")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--url", help="benchmark a running server instead of an in-process one")
+    ap.add_argument("--out", help="results file (default bench_results/<timestamp>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = ap.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    res = run(args)
+    out = args.out or os.path.join("bench_results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(res, f, indent=2)
+    print("wrote", out)
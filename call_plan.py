@@ -0,0 +1,73 @@
+"""Everything the voice agent needs for one call, in one response.
+
+A call used to go search -> evaluate_counter (up to 3 times) -> add-hours ->
+search again for a backhaul, with a network hop and dead air at every step.
+``build_plan`` answers all of it against a single catalog snapshot. For
+each of the top loads it returns the full negotiation ladder (every
+``/evaluate_counter`` answer, regular and urgent), the moment the urgent
+ceiling kicks in, and the best backhauls out of the delivery city.
+
+Plans are kept per ``call_id`` (``Sessions``, in-process LRU with a TTL), so
+a repeated request within the call, or a GET, returns the same plan until
+the catalog changes.
+"""
+import threading, time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import backhaul, negotiation
+
+
+def iso(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def build_plan(snapshot, top: list, deadhead: list, now: float,
+               window_hours: float = backhaul.DEFAULT_WINDOW_HOURS, backhauls_per_load: int = 3) -> dict:
+    index, c = snapshot.index, snapshot.catalog
+    loads = []
+    for i, pos in enumerate(top):
+        ladder = negotiation.POLICY.ladder(c.rate[pos], c.ceiling[pos], c.urgent_ceiling[pos])
+        ladder["urgent_from"] = iso(c.urgent_from[pos])
+        ladder["ceiling_now"] = round(c.ceiling_at(pos, now), 2)
+        entry = {"load": index.loads[pos], "negotiation": ladder,
+                 "backhauls": backhaul.find_backhauls(index, pos, window_hours, backhauls_per_load)}
+        if deadhead is not None:
+            entry["deadhead_miles"] = deadhead[i]
+        loads.append(entry)
+    return {"catalog_version": snapshot.version, "generated_at": iso(now), "loads": loads}
+
+
+class Sessions:
+    """call_id -> (request key, plan), bounded LRU with a TTL."""
+
+    def __init__(self, maxsize: int = 10000, ttl_seconds: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()  # call_id -> (stored_at, key, plan)
+        self._lock = threading.Lock()
+
+    def get(self, call_id: str, key=None, version: int = None):
+        """Stored plan, if present, fresh, and (when given) for the same request and catalog version."""
+        with self._lock:
+            hit = self._entries.get(call_id)
+            if hit is None:
+                return None
+            stored_at, stored_key, plan = hit
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[call_id]
+                return None
+            if (key is not None and stored_key != key) or (version is not None and plan["catalog_version"] != version):
+                return None
+            self._entries.move_to_end(call_id)
+            return plan
+
+    def put(self, call_id: str, key, plan: dict):
+        with self._lock:
+            self._entries[call_id] = (time.monotonic(), key, plan)
+            self._entries.move_to_end(call_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
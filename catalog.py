@@ -0,0 +1,142 @@
+"""Compiled load catalog.
+
+``loads.json`` is parsed once into fixed-width columns: places and equipment
+strings are interned to small integer codes, pickup/delivery become epoch
+seconds and rates/miles plain floats. Hot paths compare integers instead of
+re-splitting city names and re-parsing ISO datetimes on every request.
+
+A place is the normalized "city, st" and is what gets geocoded, so two
+Springfields are two points. Search matches by city name, like the original
+scorer did, through ``places_named``: a name maps to all of its places.
+"""
+from array import array
+from copy import copy
+from datetime import datetime, timezone
+
+from geo import default_gazetteer
+from negotiation import URGENT_SECONDS, ceilings
+
+MISSING_MILES = 99999.0
+# per-position columns, in the order ``_values`` returns them
+COLUMNS = ("origin", "dest", "equip", "pickup", "delivery", "miles", "rate", "ceiling", "urgent_ceiling", "urgent_from")
+
+
+def city_key(s: str) -> str:
+    return s.split(",")[0].strip().lower()
+
+
+def place_key(s: str) -> str:
+    return ", ".join(p.strip().lower() for p in s.split(",")[:2])
+
+
+def epoch(s: str) -> float:
+    # naive timestamps are read as UTC instead of failing the comparison
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class Catalog:
+    def __init__(self, loads: list):
+        self.sources = list(loads)  # original dicts, returned verbatim by the API
+        self.ids, self.id_pos = [], {}
+        self.places, self.place_codes = [], {}
+        self.place_points = {}  # place code -> (lat, lon), geocoded offline at build time
+        self.names, self.name_codes = [], {}  # city names (no state)
+        self.place_name = array("i")  # place code -> name code
+        self.name_places = {}  # name code -> [place codes]
+        self.equipment, self.equip_codes = [], {}
+        self.origin, self.dest, self.equip = array("i"), array("i"), array("i")
+        self.pickup, self.delivery = array("q"), array("q")
+        self.miles, self.rate = array("d"), array("d")
+        # negotiation ceilings are fixed per load; only "is pickup within 12h" depends on now
+        self.ceiling, self.urgent_ceiling, self.urgent_from = array("d"), array("d"), array("q")
+        for L in self.sources:
+            self._append(L)
+
+    def _values(self, L: dict) -> tuple:
+        origin, dest = self._city(L["origin"]), self._city(L["destination"])
+        equip = self._code(self.equipment, self.equip_codes, L["equipment_type"].lower())
+        pickup, rate = int(epoch(L["pickup_datetime"])), float(L["loadboard_rate"])
+        regular, urgent = ceilings(rate)
+        return (origin, dest, equip, pickup, int(epoch(L["delivery_datetime"])),
+                float(L.get("miles", MISSING_MILES)), rate, regular, urgent, pickup - URGENT_SECONDS)
+
+    def _append(self, L: dict):
+        self.id_pos.setdefault(L["load_id"], len(self.ids))
+        self.ids.append(L["load_id"])
+        for name, v in zip(COLUMNS, self._values(L)):
+            getattr(self, name).append(v)
+
+    def extend(self, loads: list) -> list:
+        """Append loads and return their positions."""
+        start = len(self.ids)
+        for L in loads:
+            self.sources.append(L)
+            self._append(L)
+        return list(range(start, len(self.ids)))
+
+    def replace(self, pos: int, L: dict):
+        """New version of the load at ``pos`` (same load_id), keeping its position and so its tie order."""
+        self.sources[pos] = L
+        for name, v in zip(COLUMNS, self._values(L)):
+            getattr(self, name)[pos] = v
+
+    def drop(self, pos: int):
+        # tombstone: positions stay stable until the next full rebuild
+        if self.id_pos.get(self.ids[pos]) == pos:
+            del self.id_pos[self.ids[pos]]
+        self.ids[pos] = None
+        self.sources[pos] = None
+
+    def copy(self) -> "Catalog":
+        c = Catalog.__new__(Catalog)
+        for k, v in self.__dict__.items():
+            c.__dict__[k] = copy(v)
+        return c
+
+    def _city(self, city_state: str) -> int:
+        key = place_key(city_state)
+        c = self.place_codes.get(key)
+        if c is None:
+            c = self._code(self.places, self.place_codes, key)
+            self._add_name(c, city_key(key))
+            point = default_gazetteer().lookup(key)
+            if point is not None:
+                self.place_points[c] = point
+        return c
+
+    def _add_name(self, place: int, name: str):
+        n = self._code(self.names, self.name_codes, name)
+        self.place_name.append(n)
+        # a new list, never an append: copies share these lists with older snapshots
+        self.name_places[n] = self.name_places.get(n, []) + [place]
+
+    @staticmethod
+    def _code(table: list, codes: dict, key: str) -> int:
+        c = codes.get(key)
+        if c is None:
+            c = codes[key] = len(table)
+            table.append(key)
+        return c
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name_code(self, s: str) -> int:
+        return self.name_codes.get(city_key(s), -1)
+
+    def places_named(self, s: str) -> list:
+        """Place codes sharing the city name of ``s`` (any state): what an exact city match means."""
+        return self.name_places.get(self.name_code(s), [])
+
+    def equip_code(self, s: str) -> int:
+        return self.equip_codes.get(s.lower(), -1)
+
+    def position(self, load_id: str):
+        return self.id_pos.get(load_id)
+
+    def ceiling_at(self, pos: int, now: float) -> float:
+        return self.urgent_ceiling[pos] if now >= self.urgent_from[pos] else self.ceiling[pos]
+
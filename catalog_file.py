@@ -0,0 +1,296 @@
+"""Shared, memory-mapped catalog file for multi-worker deployments.
+
+With several uvicorn workers, every process used to parse ``loads.json`` and
+hold its own catalog and indexes. ``CATALOG_FILE`` instead points all
+workers at one read-only file. The file is built once and mapped by every
+process, so the page cache holds a single copy:
+
+    magic "LOADCAT1" | u32 header length | JSON header | 8-byte aligned sections
+
+The header carries the small tables (place and equipment names, place
+points), the loads.json fingerprint and pricing policy the file was built
+from, a generation number and ``{section: [typecode, offset, count]}``. Sections are
+fixed-width columns (the same ones ``Catalog`` keeps in ``array``s),
+CSR-encoded postings and departure lists (offsets per place/equipment code +
+positions; the pair postings, keyed by ``search.pair``, are sparse and add a
+sorted key section), and two string tables (offsets + UTF-8 blob): load ids and the
+original load JSON. Columns are exposed as ``memoryview`` casts, so
+searches index the mapping directly. A load's JSON is decoded only when a
+response needs it.
+
+Rebuilds write ``<file>.<pid>.tmp`` and ``os.replace`` it over the old
+file, under an exclusive ``flock`` so only one worker builds. A file from
+another ``FORMAT_VERSION`` or ``negotiation.POLICY`` (the ceilings are
+precomputed) is rebuilt just like one from an older loads.json. Each worker's
+reload thread sees the new inode and maps the new generation. Requests
+still holding the old snapshot keep its (unlinked) mapping alive until they
+finish.
+
+    python catalog_file.py build [loads.json] [loads.cat]
+"""
+import fcntl, json, mmap, os, struct, sys
+from array import array
+from bisect import bisect_left
+
+import negotiation
+from catalog import Catalog, city_key
+from catalog_manager import FileSource
+from search import DEPARTURES, POSTING_KEYS, LoadIndex
+
+MAGIC = b"LOADCAT1"
+FORMAT_VERSION = 3
+# (section, typecode) for the per-position columns shared with Catalog
+COLUMNS = [("origin", "i"), ("dest", "i"), ("equip", "i"), ("pickup", "q"), ("delivery", "q"),
+           ("miles", "d"), ("rate", "d"), ("ceiling", "d"), ("urgent_ceiling", "d"), ("urgent_from", "q")]
+
+
+# ---------- writing ----------
+def _csr(postings: dict, keys) -> tuple:
+    offsets, positions = array("q", [0]), array("i")
+    for key in keys:
+        positions.extend(postings.get(key, ()))
+        offsets.append(len(positions))
+    return offsets, positions
+
+
+def _strings(values) -> tuple:
+    offsets, blob = array("q", [0]), bytearray()
+    for v in values:
+        blob += v.encode()
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def write(path: str, catalog: Catalog, index: LoadIndex, source_fingerprint, generation: int):
+    """Serialize a freshly built (untombstoned) catalog and index, then swap it in atomically."""
+    n_places, n_equip = len(catalog.places), len(catalog.equipment)
+    sections = [(name, getattr(catalog, name)) for name, _ in COLUMNS]
+    sections.append(("short", array("B", index.short)))
+    keys = {"by_origin": range(n_places), "by_dest": range(n_places), "by_equip": range(n_equip)}
+    for name in POSTING_KEYS:
+        postings = getattr(index, name)
+        if name not in keys:  # sparse: store the keys too
+            keys[name] = array("q", sorted(postings))
+            sections.append((name + "_keys", keys[name]))
+        offsets, positions = _csr(postings, keys[name])
+        sections += [(name + "_off", offsets), (name + "_pos", positions)]
+    for name, of in DEPARTURES.items():
+        times, order = array("q"), array("i")  # offsets are those of the postings they order
+        for key in keys[of]:
+            t, o = getattr(index, name).get(key, ((), ()))
+            times.extend(t); order.extend(o)
+        sections += [(name + "_times", times), (name + "_pos", order)]
+    sections += [("pickup_order", array("i", index.pickup_order)), ("pickup_sorted", array("q", index.pickup_sorted)),
+                 ("id_order", array("i", sorted(range(len(catalog)), key=catalog.ids.__getitem__)))]
+    for name, values in (("ids", catalog.ids),
+                         ("sources", (json.dumps(L, separators=(",", ":")) for L in catalog.sources))):
+        offsets, blob = _strings(values)
+        sections += [(name + "_off", offsets), (name + "_blob", array("B", blob))]
+
+    layout, offset = {}, 0
+    for name, col in sections:
+        layout[name] = [col.typecode, offset, len(col)]
+        offset += -(-len(col) * col.itemsize // 8) * 8
+    header = json.dumps({
+        "version": FORMAT_VERSION, "generation": generation, "n": len(catalog),
+        "source_fingerprint": list(source_fingerprint), "policy": negotiation.POLICY.spec(), "places": catalog.places,
+        "equipment": catalog.equipment, "place_points": {str(c): p for c, p in catalog.place_points.items()},
+        "sections": layout}).encode()
+    start = -(-(len(MAGIC) + 4 + len(header)) // 8) * 8
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        f.write(b"\0" * (start - f.tell()))
+        for name, col in sections:
+            data = col.tobytes()
+            f.write(data + b"\0" * (-len(data) % 8))
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_header(path: str):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + 4)
+            if len(head) < len(MAGIC) + 4 or head[:len(MAGIC)] != MAGIC:
+                return None
+            return json.loads(f.read(struct.unpack("<I", head[len(MAGIC):])[0]))
+    except FileNotFoundError:
+        return None
+
+
+# ---------- reading ----------
+class StringTable:
+    """Read-only sequence of UTF-8 strings (or JSON objects) stored as offsets + blob."""
+
+    def __init__(self, offsets, blob, decode=bytes.decode):
+        self.offsets, self.blob, self.decode = offsets, blob, decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.decode(self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class Postings:
+    """CSR postings: code -> positions (a memoryview slice), dict-style ``get``/``items``.
+
+    With ``keys`` (sorted) the i-th run belongs to ``keys[i]``, otherwise to code i.
+    """
+
+    def __init__(self, offsets, *columns, keys=None):
+        self.offsets, self.columns, self.keys = offsets, columns, keys
+
+    def _run(self, code: int):
+        if self.keys is None:
+            return code if 0 <= code < len(self.offsets) - 1 else None
+        i = bisect_left(self.keys, code)
+        return i if i < len(self.keys) and self.keys[i] == code else None
+
+    def get(self, code: int, default=None):
+        i = self._run(code)
+        if i is None:
+            return default
+        a, b = self.offsets[i], self.offsets[i + 1]
+        if a == b:
+            return default
+        return self.columns[0][a:b] if len(self.columns) == 1 else tuple(c[a:b] for c in self.columns)
+
+    def items(self):
+        for i in range(len(self.offsets) - 1):
+            code = i if self.keys is None else self.keys[i]
+            v = self.get(code)
+            if v is not None:
+                yield code, v
+
+
+class MappedCatalog(Catalog):
+    """``Catalog`` whose columns are views into a mapped catalog file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.file_fingerprint = _stat_fingerprint(os.fstat(f.fileno()))
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mv = memoryview(self._mm)
+        n = struct.unpack("<I", mv[len(MAGIC):len(MAGIC) + 4])[0]
+        base = len(MAGIC) + 4
+        h = self.header = json.loads(mv[base:base + n].tobytes())
+        if h["version"] != FORMAT_VERSION:
+            raise ValueError(f"unsupported catalog file version {h['version']}")
+        self.generation = h["generation"]
+        self.source_fingerprint = tuple(h["source_fingerprint"])
+        start = -(-(base + n) // 8) * 8  # section offsets are relative to the aligned end of the header
+        self.sections = {}
+        for name, (typecode, offset, count) in h["sections"].items():
+            size = array(typecode).itemsize
+            self.sections[name] = mv[start + offset:start + offset + count * size].cast(typecode)
+        s = self.sections
+        for name, _ in COLUMNS:
+            setattr(self, name, s[name])
+        self.ids = StringTable(s["ids_off"], s["ids_blob"])
+        self.sources = StringTable(s["sources_off"], s["sources_blob"], json.loads)
+        self.id_pos = None  # lookups go through the sorted id_order section
+        self.places, self.equipment = h["places"], h["equipment"]
+        self.place_codes = {c: i for i, c in enumerate(self.places)}
+        self.equip_codes = {e: i for i, e in enumerate(self.equipment)}
+        self.place_points = {int(c): tuple(p) for c, p in h["place_points"].items()}
+        self.names, self.name_codes, self.place_name, self.name_places = [], {}, array("i"), {}
+        for code, place in enumerate(self.places):
+            self._add_name(code, city_key(place))
+
+    def __len__(self):
+        return self.header["n"]
+
+    def position(self, load_id: str):
+        order = self.sections["id_order"]
+        i = bisect_left(order, load_id, key=self.ids.__getitem__)
+        if i < len(order) and self.ids[order[i]] == load_id:
+            return order[i]
+        return None
+
+    def copy(self):
+        raise TypeError("mapped catalogs are immutable; rebuild the file instead")
+
+
+class MappedIndex(LoadIndex):
+    """``LoadIndex`` over a ``MappedCatalog``; nothing is built, every structure is a view."""
+
+    def __init__(self, catalog: MappedCatalog):
+        s = catalog.sections
+        self.catalog, self.loads = catalog, catalog.sources
+        self.dead = frozenset()
+        self.short = s["short"]
+        for name in POSTING_KEYS:
+            setattr(self, name, Postings(s[name + "_off"], s[name + "_pos"], keys=s.get(name + "_keys")))
+        for name, of in DEPARTURES.items():
+            setattr(self, name, Postings(s[of + "_off"], s[name + "_times"], s[name + "_pos"], keys=s.get(of + "_keys")))
+        self.pickup_order, self.pickup_sorted = s["pickup_order"], s["pickup_sorted"]
+        self._build_grids()
+
+    def patched(self, catalog, removed, changed, added):
+        raise TypeError("mapped indexes are immutable; rebuild the file instead")
+
+
+# ---------- source for CatalogManager ----------
+def _stat_fingerprint(st) -> tuple:
+    # inode included: os.replace swaps in a new file even when size and mtime collide
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class MappedSource:
+    """Keeps ``path`` built from ``loads_path`` and maps it; used by CatalogManager in place of FileSource."""
+
+    def __init__(self, loads_path: str, path: str):
+        self.loads = FileSource(loads_path)
+        self.path = path
+
+    def fingerprint(self):
+        try:
+            mapped = _stat_fingerprint(os.stat(self.path))
+        except FileNotFoundError:
+            mapped = None
+        return (self.loads.fingerprint(), mapped)
+
+    def _current(self, h, want) -> bool:
+        return (h is not None and h.get("version") == FORMAT_VERSION and h["source_fingerprint"] == want
+                and h.get("policy") == negotiation.POLICY.spec())
+
+    def ensure_built(self) -> bool:
+        """Rebuild the file if loads.json, the format or the policy changed since it was written.
+
+        True if this process rebuilt it.
+        """
+        if self._current(read_header(self.path), list(self.loads.fingerprint())):
+            return False
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # one builder; the others wait, then find it fresh
+            h = read_header(self.path)
+            want = list(self.loads.fingerprint())
+            if self._current(h, want):
+                return False
+            catalog = Catalog(self.loads.read())
+            write(self.path, catalog, LoadIndex(catalog), want, (h.get("generation", 0) if h else 0) + 1)
+        return True
+
+    def open(self) -> tuple:
+        """(catalog, index, fingerprint) of the current generation, rebuilding it first if stale."""
+        self.ensure_built()
+        catalog = MappedCatalog(self.path)
+        return catalog, MappedIndex(catalog), (catalog.source_fingerprint, catalog.file_fingerprint)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        sys.exit("usage: python catalog_file.py build [loads.json] [catalog file]")
+    src = MappedSource(sys.argv[2] if len(sys.argv) > 2 else os.getenv("LOADS_PATH", "loads.json"),
+                       sys.argv[3] if len(sys.argv) > 3 else os.getenv("CATALOG_FILE", "loads.cat"))
+    built = src.ensure_built()
+    h = read_header(src.path)
+    print(f"{src.path}: generation {h['generation']}, {h['n']} loads" + ("" if built else " (already current)"))
@@ -0,0 +1,253 @@
+"""Hot-reloadable load catalog.
+
+A background thread polls the catalog source; when it changes, the new
+catalog and indexes are built off to the side and published with a single
+attribute assignment, so request handlers never wait on a reload. Small
+edits are applied as a patch on a copy of the current catalog: edited loads
+are replaced in place, deleted ones tombstoned and new ones appended. A
+patch is only taken when that leaves the loads in file order (search ties
+follow it), i.e. new loads were added at the end of the file; reorders,
+large edits and too many tombstones trigger a full rebuild.
+
+Boot can skip parsing and indexing altogether: a ``SnapshotFile`` holds the
+pickled (catalog, index) pair of a full build, tagged with the source
+fingerprint it was built from, the code that built it and the pricing
+policy baked into its ceilings, and is memory-mapped and unpickled at
+startup when all of them still match. Build one ahead of time (e.g. in the image)
+with:
+
+    python catalog_manager.py snapshot [loads.json] [loads.snapshot]
+
+A source with an ``open()`` method (``catalog_file.MappedSource``) hands over
+a ready (catalog, index) pair instead of loads; nothing is parsed, diffed or
+indexed in this process.
+"""
+import hashlib, json, mmap, os, pickle, sys, threading, time
+from datetime import datetime, timezone
+
+import negotiation
+from catalog import Catalog
+from search import LoadIndex
+
+
+class FileSource:
+    """JSON array of loads on disk, change-detected by mtime and size."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fingerprint(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def read(self) -> list:
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class SnapshotFile:
+    """Pickled (catalog, index) with a one-line JSON header naming the source fingerprint."""
+    MAGIC = b"CATSNAP1\n"
+    MODULES = ("catalog", "search", "geo")  # whose classes are pickled
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def code_version(cls) -> str:
+        """Hash of the pickled classes' source: a snapshot from other code may lack attributes."""
+        h = hashlib.sha1()
+        for name in cls.MODULES:
+            with open(sys.modules[name].__file__, "rb") as f:
+                h.update(f.read())
+        return h.hexdigest()[:16]
+
+    def _tag(self, fingerprint) -> dict:
+        # pickles of these classes are only trusted by the same Python minor version, and the
+        # ceilings are precomputed: a policy change needs a rebuild
+        return {"fingerprint": list(fingerprint), "python": list(sys.version_info[:2]),
+                "code": self.code_version(), "policy": negotiation.POLICY.spec()}
+
+    def load(self, fingerprint):
+        """(catalog, index) if the file exists and was built from ``fingerprint``, else None."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(self.MAGIC)] != self.MAGIC:
+                return None
+            end = mm.find(b"\n", len(self.MAGIC))
+            if json.loads(mm[len(self.MAGIC):end]) != self._tag(fingerprint):
+                return None
+            with memoryview(mm)[end + 1:] as body:
+                catalog, index = pickle.loads(body)
+        return catalog, index
+
+    def save(self, catalog: Catalog, index: LoadIndex, fingerprint):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.MAGIC + json.dumps(self._tag(fingerprint)).encode() + b"\n")
+            pickle.dump((catalog, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)  # readers never see a half-written snapshot
+
+
+class CatalogSnapshot:
+    """Immutable (catalog, index) pair published by the manager."""
+    __slots__ = ("version", "catalog", "index")
+
+    def __init__(self, version: int, catalog: Catalog, index: LoadIndex):
+        self.version, self.catalog, self.index = version, catalog, index
+
+
+class CatalogManager:
+    def __init__(self, source, poll_seconds: float = 5.0,
+                 patch_fraction: float = 0.05, compact_fraction: float = 0.25, snapshot: SnapshotFile = None):
+        self.source = source
+        self.snapshot = snapshot
+        self.poll_seconds = poll_seconds
+        self.patch_fraction = patch_fraction      # max changed share applied incrementally
+        self.compact_fraction = compact_fraction  # tombstone share that forces a rebuild
+        self.current = None
+        self.stats = {"version": 0, "loads": 0, "mode": None, "reloaded_at": None,
+                      "read_ms": 0.0, "build_ms": 0.0, "added": 0, "changed": 0, "removed": 0, "generation": None,
+                      "reloads": 0, "errors": 0, "last_error": None}
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # readers grab one snapshot per request so catalog and index always agree
+    @property
+    def catalog(self) -> Catalog:
+        return self.current.catalog
+
+    @property
+    def index(self) -> LoadIndex:
+        return self.current.index
+
+    def load(self):
+        """Synchronous initial build (from the snapshot when it matches); raises if the source is unreadable."""
+        with self._lock:
+            t0 = time.perf_counter()
+            if hasattr(self.source, "open"):
+                catalog, index, fp = self.source.open()
+                self._publish(catalog, index, fp, "mapped", t0, time.perf_counter(), len(index), 0, 0)
+                return
+            fp = self.source.fingerprint()
+            if self.snapshot is not None:
+                try:
+                    hit = self.snapshot.load(fp)
+                except Exception as e:
+                    print("Catalog snapshot unreadable, rebuilding:", e)
+                    hit = None
+                if hit is not None:
+                    t1 = time.perf_counter()
+                    self._publish(hit[0], hit[1], fp, "snapshot", t0, t1, len(hit[1]), 0, 0)
+                    return
+            loads = self.source.read()
+            t1 = time.perf_counter()
+            catalog = Catalog(loads)
+            index = LoadIndex(catalog)
+            self._publish(catalog, index, fp, "full", t0, t1, len(loads), 0, 0)
+        if self.snapshot is not None:
+            # next boot starts from this build; written off the startup path
+            threading.Thread(target=self._save_snapshot, args=(catalog, index, fp), daemon=True).start()
+
+    def _save_snapshot(self, catalog, index, fp):
+        try:
+            self.snapshot.save(catalog, index, fp)
+        except Exception as e:
+            print("Catalog snapshot write failed:", e)
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuild if the source changed. Returns True when a new version was published."""
+        with self._lock:
+            fp = self.source.fingerprint()
+            if fp == self._fingerprint and not force:
+                return False
+            t0 = time.perf_counter()
+            if hasattr(self.source, "open"):
+                catalog, index, fp = self.source.open()
+                self._publish(catalog, index, fp, "mapped", t0, time.perf_counter(),
+                              len(index), 0, len(self.current.index))
+                return True
+            loads = self.source.read()
+            t1 = time.perf_counter()
+            cur = self.current
+            old = cur.catalog.id_pos
+            new = {L["load_id"]: L for L in loads}
+            removed = [p for i, p in old.items() if i not in new]
+            changed = sorted(p for i, p in old.items() if i in new and new[i] != cur.catalog.sources[p])
+            added = [L for L in loads if L["load_id"] not in old]
+            if not removed and not changed and not added:
+                self._fingerprint = fp
+                return False
+            live = max(len(old), 1)
+            dead = len(cur.index.dead) + len(removed)
+            gone = {cur.catalog.ids[p] for p in removed}
+            # patching keeps positions, so it only matches a full build when the survivors kept
+            # their order and new loads sit at the end of the file
+            in_order = len(new) == len(loads) and (
+                [i for i in cur.catalog.ids if i is not None and i not in gone]
+                + [L["load_id"] for L in added] == [L["load_id"] for L in loads])
+            if (in_order and len(removed) + len(changed) + len(added) <= self.patch_fraction * live
+                    and dead <= self.compact_fraction * (len(cur.catalog) + len(added))):
+                catalog = cur.catalog.copy()
+                for p in removed:
+                    catalog.drop(p)
+                for p in changed:
+                    catalog.replace(p, new[catalog.ids[p]])
+                index = cur.index.patched(catalog, removed, changed, catalog.extend(added))
+                mode = "incremental"
+            else:
+                catalog = Catalog(loads)
+                index = LoadIndex(catalog)
+                mode = "full"
+            self._publish(catalog, index, fp, mode, t0, t1, len(added), len(changed), len(removed))
+            return True
+
+    def _publish(self, catalog, index, fp, mode, t0, t1, added, changed, removed):
+        t2 = time.perf_counter()
+        version = self.stats["version"] + 1
+        self.current = CatalogSnapshot(version, catalog, index)  # atomic swap
+        self._fingerprint = fp
+        self.stats.update(version=version, loads=len(index), mode=mode,
+                          reloaded_at=datetime.now(timezone.utc).isoformat(),
+                          read_ms=round((t1 - t0) * 1000, 3), build_ms=round((t2 - t1) * 1000, 3),
+                          added=added, changed=changed, removed=removed, reloads=self.stats["reloads"] + 1,
+                          generation=getattr(catalog, "generation", None))
+
+    # ---------- background polling ----------
+    def start(self):
+        if self._thread is None and self.poll_seconds > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-reload", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_seconds + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.reload()
+            except Exception as e:
+                # keep serving the last good version
+                self.stats["errors"] += 1
+                self.stats["last_error"] = repr(e)
+                print("Catalog reload failed:", e)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "snapshot":
+        sys.exit("usage: python catalog_manager.py snapshot [loads.json] [snapshot path]")
+    src = FileSource(sys.argv[2] if len(sys.argv) > 2 else os.getenv("LOADS_PATH", "loads.json"))
+    out = SnapshotFile(sys.argv[3] if len(sys.argv) > 3 else os.getenv("CATALOG_SNAPSHOT_PATH", "loads.snapshot"))
+    mgr = CatalogManager(src, poll_seconds=0)
+    mgr.load()
+    out.save(mgr.catalog, mgr.index, mgr._fingerprint)
+    print(f"wrote {out.path}: {mgr.stats['loads']} loads, built in {mgr.stats['build_ms']} ms")
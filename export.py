@@ -0,0 +1,126 @@
+"""Streaming export of raw call logs (NDJSON or CSV, optionally gzipped).
+
+Rows are read with keyset pagination on ``id``: every chunk is one short
+``WHERE id > ? ORDER BY id LIMIT ?`` query on a pooled reader connection,
+which goes back to the pool before the chunk is sent. Memory stays at one
+chunk, and no read transaction is held open while a slow client downloads,
+so WAL checkpoints are never blocked. The id range is fixed when the export
+starts (``until_id``), so rows logged during a long download are left for
+the next export. Every row carries its ``id``; an interrupted download
+resumes with ``after_id`` set to the last id received.
+
+Days rolled out by the retention job (archive.py) are merged back in id
+order from the archive files, so an export spans both transparently.
+"""
+import csv, heapq, io, json, zlib
+from itertools import chain
+
+import telemetry
+from store import decompress
+
+COLUMNS = ["id", "call_id", "timestamp", "outcome", "sentiment", "rounds", "mc", "dot", "legal_name",
+           "selected_load_id", "origin", "destination", "pickup_datetime", "delivery_datetime",
+           "equipment_type", "miles", "loadboard_rate", "agreed_rate", "transcript", "ts"]
+CHUNK_ROWS = 1000
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# transcripts are stored compressed in their own table (see store.py)
+SQL_COLUMNS = {"transcript": "(SELECT body FROM transcripts WHERE call_row = calls.id)"}
+
+
+def select_columns(spec: str = None) -> list:
+    """Validated column list; ``id`` always comes first so any export can be resumed."""
+    if not spec:
+        return list(COLUMNS)
+    cols = [c.strip() for c in spec.split(",") if c.strip()]
+    unknown = [c for c in cols if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return ["id"] + [c for c in dict.fromkeys(cols) if c != "id"]
+
+
+def id_bounds(store, t0: int = None, t1: int = None, after_id: int = 0) -> tuple:
+    """(first id - 1, last id) to walk. With a time range, one pass over ``idx_calls_ts`` narrows it."""
+    where, params = [], []
+    if t0 is not None:
+        where.append("ts >= ?"); params.append(t0)
+    if t1 is not None:
+        where.append("ts < ?"); params.append(t1)
+    if where:
+        sql = "SELECT MIN(id), MAX(id) FROM calls WHERE ts IS NOT NULL AND " + " AND ".join(where)
+    else:
+        sql = "SELECT MIN(id), MAX(id) FROM calls"
+    lo, hi = store.query(sql, params)[0]
+    if hi is None:
+        return after_id, after_id
+    return max(after_id, lo - 1), hi
+
+
+def rows(store, columns: list, after_id: int, until_id: int, t0: int = None, t1: int = None,
+         chunk: int = CHUNK_ROWS):
+    """Yield lists of row tuples, one keyset page at a time, for ``after_id < id <= until_id``."""
+    sql = f"SELECT {', '.join(SQL_COLUMNS.get(c, c) for c in columns)} FROM calls WHERE id > ? AND id <= ?"
+    text = columns.index("transcript") if "transcript" in columns else None
+    filters = []
+    if t0 is not None:
+        sql += " AND ts >= ?"; filters.append(t0)
+    if t1 is not None:
+        sql += " AND ts < ?"; filters.append(t1)
+    sql += " ORDER BY id LIMIT ?"
+    last = after_id
+    while last < until_id:
+        with telemetry.timed("export.chunk"), store.reader() as con:
+            page = con.execute(sql, [last, until_id, *filters, chunk]).fetchall()
+        if not page:
+            return
+        if text is None:
+            yield [tuple(r) for r in page]
+        else:
+            yield [(*r[:text], decompress(r[text]), *r[text + 1:]) for r in page]
+        last = page[-1][0]
+
+
+def merged(pages, archived, chunk: int = CHUNK_ROWS):
+    """Live pages and archived row tuples (both in id order) as one stream of pages."""
+    page = []
+    for r in heapq.merge(chain.from_iterable(pages), archived, key=lambda r: r[0]):
+        page.append(r)
+        if len(page) >= chunk:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def ndjson(pages, columns: list):
+    for page in pages:
+        yield "".join(json.dumps(dict(zip(columns, r)), separators=(",", ":")) + "\n" for r in page).encode()
+
+
+def csv_lines(pages, columns: list):
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(columns)
+    for page in pages:
+        w.writerows(page)
+        yield buf.getvalue().encode()
+        buf.seek(0); buf.truncate()
+    if buf.tell():  # header only: nothing matched
+        yield buf.getvalue().encode()
+
+
+def gzipped(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for data in chunks:
+        out = z.compress(data)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def stream(store, fmt: str, columns: list, after_id: int, until_id: int, t0: int = None, t1: int = None,
+           gzip: bool = False, archived=None):
+    pages = rows(store, columns, after_id, until_id, t0, t1)
+    if archived is not None:
+        pages = merged(pages, archived)
+    body = ndjson(pages, columns) if fmt == "ndjson" else csv_lines(pages, columns)
+    return gzipped(body) if gzip else body
@@ -0,0 +1,100 @@
+"""Offline geocoding and radius queries.
+
+``cities.json`` ships with the app and maps "City, ST" to [lat, lon]; no
+network lookups happen at runtime. Catalog places ("City, ST", so two
+Springfields are two points) are geocoded once when the catalog is built,
+and ``CityGrid`` buckets them into 1-degree cells so an "origin within N
+miles" query only measures the handful of places in the cells the radius
+touches. Loads hang off place codes, so the load count does not enter into
+it.
+"""
+import json, math, os
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEG_LAT = 69.0
+CELL_DEG = 1.0
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.json"))
+
+
+def haversine_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Gazetteer:
+    def __init__(self, entries: dict):
+        self.exact = {}
+        by_city = {}
+        for name, (lat, lon) in entries.items():
+            self.exact[self._norm(name)] = (lat, lon)
+            by_city.setdefault(name.split(",")[0].strip().lower(), []).append((lat, lon))
+        # a bare city name is only trusted when it is unambiguous
+        self.city_only = {k: v[0] for k, v in by_city.items() if len(v) == 1}
+
+    @staticmethod
+    def _norm(s: str) -> str:
+        parts = [p.strip().lower() for p in s.split(",")]
+        return ", ".join(parts[:2])
+
+    def lookup(self, city_state: str):
+        """(lat, lon) for "City, ST" (or an unambiguous "City"), else None."""
+        if not city_state:
+            return None
+        hit = self.exact.get(self._norm(city_state))
+        if hit is None:
+            hit = self.city_only.get(city_state.split(",")[0].strip().lower())
+        return hit
+
+
+_default = None
+
+
+def default_gazetteer() -> Gazetteer:
+    global _default
+    if _default is None:
+        try:
+            with open(GAZETTEER_PATH) as f:
+                _default = Gazetteer(json.load(f))
+        except FileNotFoundError:
+            _default = Gazetteer({})
+    return _default
+
+
+def point_of(spec: dict, gazetteer: Gazetteer = None):
+    """(lat, lon) for a criteria dict: explicit lat/lon wins over city_state."""
+    if spec.get("lat") is not None and spec.get("lon") is not None:
+        return float(spec["lat"]), float(spec["lon"])
+    return (gazetteer or default_gazetteer()).lookup(spec.get("city_state", ""))
+
+
+class CityGrid:
+    """Uniform lat/lon grid over geocoded places (place code -> point)."""
+
+    def __init__(self, points: dict):
+        self.points = points
+        self.cells = {}
+        for code, (lat, lon) in points.items():
+            self.cells.setdefault(self._cell(lat, lon), []).append(code)
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> tuple:
+        return (math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG))
+
+    def within(self, lat: float, lon: float, radius_miles: float) -> dict:
+        """{place code: distance in miles} for places within the radius."""
+        dlat = radius_miles / MILES_PER_DEG_LAT
+        coslat = max(math.cos(math.radians(lat)), 0.01)
+        dlon = min(radius_miles / (MILES_PER_DEG_LAT * coslat), 180.0)
+        i0, j0 = self._cell(lat - dlat, lon - dlon)
+        i1, j1 = self._cell(lat + dlat, lon + dlon)
+        out = {}
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for code in self.cells.get((i, j), ()):
+                    plat, plon = self.points[code]
+                    dist = haversine_miles(lat, lon, plat, plon)
+                    if dist <= radius_miles:
+                        out[code] = dist
+        return out
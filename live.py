@@ -0,0 +1,98 @@
+"""Server-Sent Events fan-out for the live dashboard.
+
+One ``Publisher`` per process. The call-log writer reports each committed
+batch, and the app publishes that batch's rollup delta (``rollups.delta``).
+One publish means one JSON encode plus one ``put_nowait`` per subscriber,
+and bursts of calls coalesce into a single delta per flush. Subscribers are
+capped, and each one has a small bounded queue. A viewer that falls behind
+is not allowed to buffer without limit: its backlog is dropped and it gets a
+fresh snapshot instead. Every stream also re-snapshots periodically, which
+covers calls committed by other worker processes.
+
+A subscriber is registered before its snapshot is read, so deltas for
+batches committed in between can already be queued. Deltas carry a sequence
+number (the batch's last call id) and snapshots the last id they include;
+``stream`` drops every queued delta the snapshot already counts.
+"""
+import asyncio, json, time
+
+RESYNC = object()
+CLOSE = object()
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def event(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Publisher:
+    def __init__(self, max_subscribers: int = 50, queue_size: int = 32):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.stats = {"published": 0, "resyncs": 0, "rejected": 0}
+
+    def subscribe(self) -> asyncio.Queue:
+        if len(self.subscribers) >= self.max_subscribers:
+            self.stats["rejected"] += 1
+            raise TooManySubscribers(f"at most {self.max_subscribers} live viewers")
+        q = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue):
+        self.subscribers.discard(q)
+
+    def _offer(self, q: asyncio.Queue, msg):
+        try:
+            q.put_nowait(msg)
+        except asyncio.QueueFull:
+            # too slow to keep up: drop its backlog, it re-reads a snapshot
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(RESYNC)
+            self.stats["resyncs"] += 1
+
+    def publish(self, name: str, data, seq: int = None):
+        """Call on the event loop thread; ``seq`` orders the event against snapshots."""
+        if not self.subscribers:
+            return
+        msg = (seq, event(name, data))
+        for q in list(self.subscribers):
+            self._offer(q, msg)
+        self.stats["published"] += 1
+
+    def close(self):
+        for q in list(self.subscribers):
+            self._offer(q, CLOSE)
+
+
+async def stream(pub: Publisher, q: asyncio.Queue, snapshot, heartbeat: float = 15.0, resync: float = 60.0):
+    """SSE body for one subscriber; ``snapshot`` is an async callable returning the full metrics (and its ``seq``)."""
+    try:
+        yield "retry: 3000\n\n"
+        snap = await snapshot()
+        seen = snap.get("seq")
+        yield event("snapshot", snap)
+        next_snapshot = time.monotonic() + resync
+        while True:
+            try:
+                msg = await asyncio.wait_for(q.get(), min(heartbeat, max(0.0, next_snapshot - time.monotonic())))
+            except asyncio.TimeoutError:
+                msg = None
+            if msg is CLOSE:
+                return
+            if msg is RESYNC or time.monotonic() >= next_snapshot:
+                snap = await snapshot()
+                seen = snap.get("seq")
+                yield event("snapshot", snap)
+                next_snapshot = time.monotonic() + resync
+            elif msg is None:
+                yield ": ping\n\n"  # keeps proxies from closing an idle stream
+            elif msg[0] is None or seen is None or msg[0] > seen:
+                yield msg[1]
+    finally:
+        pub.unsubscribe(q)
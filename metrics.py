@@ -0,0 +1,178 @@
+"""Time-range metrics over the indexed ``calls.ts`` column.
+
+All-time numbers come from the rollup tables (see rollups.py). When a
+dashboard asks for a window, these queries walk only that slice of the
+covering ``idx_calls_ts`` index (or the lane / carrier index when filtered),
+so "last 24h" touches the last day of rows no matter how long the history is.
+Buckets are UTC; weeks start on Monday.
+
+Queries produce hourly "parts" (counts and sums, no averages or top-N) that
+merge exactly, so archived days contribute precomputed parts instead of rows.
+"""
+import re, time
+from datetime import datetime, timezone
+
+from rollups import WIN_OUTCOME
+
+GRANULARITY = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+WEEK_ORIGIN = 4 * 86400  # 1970-01-05, the first Monday of the epoch
+_RELATIVE = re.compile(r"^(\d+)([mhdw])$")
+_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_time(s: str, now: float = None) -> int:
+    """ISO 8601 date/datetime (naive = UTC), or a look-back like ``24h`` / ``7d``."""
+    m = _RELATIVE.match(s.strip())
+    if m:
+        return int((now if now is not None else time.time()) - int(m.group(1)) * _UNITS[m.group(2)])
+    dt = datetime.fromisoformat(s.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def bucket_sql(granularity: str) -> str:
+    n = GRANULARITY[granularity]
+    if granularity == "week":
+        return f"ts - (ts - {WEEK_ORIGIN}) % {n}"
+    return f"ts - ts % {n}"
+
+
+def bucket_label(t: int, granularity: str) -> str:
+    dt = datetime.fromtimestamp(t, timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:00Z") if granularity == "hour" else dt.date().isoformat()
+
+
+def _where(t0, t1, origin, destination, mc):
+    where, params = ["ts IS NOT NULL"], []
+    if t0 is not None:
+        where.append("ts >= ?"); params.append(t0)
+    if t1 is not None:
+        where.append("ts < ?"); params.append(t1)
+    for col, val in (("origin", origin), ("destination", destination), ("mc", mc)):
+        if val is not None:
+            where.append(f"{col} = ?"); params.append(val)
+    return " AND ".join(where), params
+
+
+# ---------- mergeable parts ----------
+# A part is the JSON-friendly sum of some calls: {"hours": {hour start: [calls, wins]}, "outcome",
+# "sentiment", "equipment": {key: calls}, "rate": [n, total], "lanes": [[origin, destination, calls,
+# wins, n, total]], "carriers": [[mc, calls, wins, n, total]]}, where n / total count and sum the
+# agreed - listed deltas. Parts of disjoint call sets merge exactly; finish() turns one into metrics.
+def range_part(con, t0: int = None, t1: int = None, origin: str = None, destination: str = None,
+               mc: str = None, top: int = None) -> dict:
+    """Part for the ``calls`` rows in [t0, t1). ``top`` keeps only the busiest lanes and carriers,
+    for a part nothing else is merged into."""
+    w, params = _where(t0, t1, origin, destination, mc)
+    win = f"outcome IS '{WIN_OUTCOME}'"
+    delta = "agreed_rate - loadboard_rate"
+    limit = f" ORDER BY 3 DESC LIMIT {int(top)}" if top is not None else ""
+
+    def q(sql):
+        return con.execute(sql, params).fetchall()
+
+    rate = q(f"SELECT COUNT({delta}), TOTAL({delta}) FROM calls WHERE {w}")[0]
+    return {
+        "hours": {str(r[0]): [r[1], r[2]] for r in q(
+            f"SELECT ts - ts % 3600 b, COUNT(*), SUM({win}) FROM calls WHERE {w} GROUP BY b")},
+        "outcome": {r[0]: r[1] for r in q(
+            f"SELECT COALESCE(NULLIF(outcome, ''), 'unknown') k, COUNT(*) FROM calls WHERE {w} GROUP BY k")},
+        "sentiment": {r[0]: r[1] for r in q(
+            f"SELECT COALESCE(NULLIF(sentiment, ''), 'unknown') k, COUNT(*) FROM calls WHERE {w} GROUP BY k")},
+        "equipment": {r[0]: r[1] for r in q(
+            f"SELECT equipment_type, COUNT(*) FROM calls WHERE {w} AND equipment_type IS NOT NULL "
+            f"GROUP BY equipment_type")},
+        "rate": list(rate),
+        "lanes": [list(r) for r in q(
+            f"SELECT origin, destination, COUNT(*), SUM({win}), COUNT({delta}), TOTAL({delta}) "
+            f"FROM calls WHERE {w} GROUP BY origin, destination{limit}")],
+        "carriers": [list(r) for r in q(
+            f"SELECT mc, COUNT(*), SUM({win}), COUNT({delta}), TOTAL({delta}) "
+            f"FROM calls WHERE {w} AND mc IS NOT NULL GROUP BY mc{limit}")],
+    }
+
+
+def part_of(calls) -> dict:
+    """Part for call dicts (the archive's rows), like ``range_part`` over the same calls."""
+    hours, outcome, sentiment, equipment, lanes, carriers = {}, {}, {}, {}, {}, {}
+    rate = [0, 0.0]
+
+    def add(acc, won, delta):
+        acc[0] += 1; acc[1] += won
+        if delta is not None:
+            acc[2] += 1; acc[3] += delta
+
+    for r in calls:
+        won = r["outcome"] == WIN_OUTCOME
+        delta = None
+        if r["agreed_rate"] is not None and r["loadboard_rate"] is not None:
+            delta = r["agreed_rate"] - r["loadboard_rate"]
+            rate[0] += 1; rate[1] += delta
+        h = hours.setdefault(str(r["ts"] - r["ts"] % 3600), [0, 0])
+        h[0] += 1; h[1] += won
+        for counts, k in ((outcome, r["outcome"] or "unknown"), (sentiment, r["sentiment"] or "unknown"),
+                          (equipment, r["equipment_type"])):
+            if k is not None:
+                counts[k] = counts.get(k, 0) + 1
+        add(lanes.setdefault((r["origin"], r["destination"]), [0, 0, 0, 0.0]), won, delta)
+        if r["mc"] is not None:
+            add(carriers.setdefault(r["mc"], [0, 0, 0, 0.0]), won, delta)
+    return {"hours": hours, "outcome": outcome, "sentiment": sentiment, "equipment": equipment, "rate": rate,
+            "lanes": [[*k, *v] for k, v in lanes.items()], "carriers": [[k, *v] for k, v in carriers.items()]}
+
+
+def merge(parts: list) -> dict:
+    hours, counts, lanes, carriers = {}, {"outcome": {}, "sentiment": {}, "equipment": {}}, {}, {}
+    rate = [0, 0.0]
+    for p in parts:
+        for b, (c, w) in p["hours"].items():
+            h = hours.setdefault(b, [0, 0])
+            h[0] += c; h[1] += w
+        for name, into in counts.items():
+            for k, c in p[name].items():
+                into[k] = into.get(k, 0) + c
+        rate[0] += p["rate"][0]; rate[1] += p["rate"][1]
+        for groups, rows, width in ((lanes, p["lanes"], 2), (carriers, p["carriers"], 1)):
+            for r in rows:
+                acc = groups.setdefault(tuple(r[:width]), [0, 0, 0, 0.0])
+                for i, v in enumerate(r[width:]):
+                    acc[i] += v
+    return {"hours": hours, **counts, "rate": rate,
+            "lanes": [[*k, *v] for k, v in lanes.items()], "carriers": [[*k, *v] for k, v in carriers.items()]}
+
+
+def finish(part: dict, t0: int = None, t1: int = None, granularity: str = "day", top: int = 20) -> dict:
+    """Same shape as rollups.read_metrics plus lane/carrier breakdowns."""
+    n = GRANULARITY[granularity]
+    series = {}
+    for h, (c, w) in part["hours"].items():
+        h = int(h)
+        b = h - (h - WEEK_ORIGIN) % n if granularity == "week" else h - h % n
+        acc = series.setdefault(b, [0, 0])
+        acc[0] += c; acc[1] += w
+
+    def avg(n, total):
+        return round(total / n, 2) if n else None
+
+    lanes = sorted(part["lanes"], key=lambda r: -r[2])[:top]
+    carriers = sorted(part["carriers"], key=lambda r: -r[1])[:top]
+    return {"by_outcome": part["outcome"], "by_sentiment": part["sentiment"],
+            "daily": [{"date": bucket_label(b, granularity), "calls": c, "wins": w}
+                      for b, (c, w) in sorted(series.items())],
+            "by_equipment": part["equipment"], "avg_rate_delta": avg(*part["rate"]) or 0.0,
+            "by_lane": [{"origin": o, "destination": d, "calls": c, "wins": w, "avg_rate_delta": avg(k, t)}
+                        for o, d, c, w, k, t in lanes],
+            "by_carrier": [{"mc": m, "calls": c, "wins": w, "avg_rate_delta": avg(k, t)}
+                           for m, c, w, k, t in carriers],
+            "granularity": granularity,
+            "from": datetime.fromtimestamp(t0, timezone.utc).isoformat() if t0 is not None else None,
+            "to": datetime.fromtimestamp(t1, timezone.utc).isoformat() if t1 is not None else None}
+
+
+def range_metrics(con, t0: int = None, t1: int = None, granularity: str = "day",
+                  origin: str = None, destination: str = None, mc: str = None, top: int = 20,
+                  archived: list = ()) -> dict:
+    """Metrics for [t0, t1): the live ``calls`` rows plus ``archived`` parts (see archive.py)."""
+    live = range_part(con, t0, t1, origin, destination, mc, None if archived else top)
+    return finish(merge([live, *archived]) if archived else live, t0, t1, granularity, top)
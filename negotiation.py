@@ -0,0 +1,108 @@
+"""Negotiation guardrails used by /evaluate_counter.
+
+Ceiling = listed rate + 12%, plus another 5% when pickup is within 12 hours.
+Above the ceiling the broker counters at listed, then min(ceiling, listed *
+1.05), then min(ceiling, listed * 1.08), and rejects after round 3.
+
+The rules are a ``Policy``. ``POLICY`` is the one the live endpoints (and the
+catalog's precomputed ceilings) use; simulate.py runs the same objects, and
+variants of them, over replayed or synthetic offers. A new rule shape is a
+subclass overriding ``evaluate``; override ``evaluate_many`` too to keep the
+simulator vectorized.
+"""
+import importlib
+
+CEILING_BUMP = 0.12
+URGENT_BUMP = 0.05
+URGENT_SECONDS = 12 * 3600
+ROUND_COUNTERS = {1: None, 2: 1.05, 3: 1.08}  # None: counter at the listed rate
+
+
+class Policy:
+    def __init__(self, name: str = "live", ceiling_bump: float = CEILING_BUMP, urgent_bump: float = URGENT_BUMP,
+                 round_counters: dict = None):
+        self.name = name
+        self.ceiling_bump = ceiling_bump
+        self.urgent_bump = urgent_bump
+        counters = ROUND_COUNTERS if round_counters is None else round_counters
+        self.round_counters = {int(r): m for r, m in counters.items()}
+        self.last_round = max(self.round_counters)
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> "Policy":
+        """``{"name", "ceiling_bump", "urgent_bump", "round_counters"}``; ``"class": "module:Name"`` for a subclass."""
+        spec = dict(spec)
+        target = spec.pop("class", None)
+        if target:
+            module, _, attr = target.partition(":")
+            cls = getattr(importlib.import_module(module), attr)
+        return cls(**spec)
+
+    def spec(self) -> dict:
+        return {"name": self.name, "ceiling_bump": self.ceiling_bump, "urgent_bump": self.urgent_bump,
+                "round_counters": {str(r): m for r, m in self.round_counters.items()}}
+
+    def ceilings(self, lb):
+        """(regular, urgent) ceiling for a listed rate (a float or a NumPy array)."""
+        bump = lb * self.ceiling_bump
+        return lb + bump, lb + (bump + lb * self.urgent_bump)
+
+    def counter(self, lb, ceiling, round_num: int):
+        """Broker's counter when the offer is above the ceiling; None once the rounds are used up."""
+        if round_num not in self.round_counters:
+            return None
+        mult = self.round_counters[round_num]
+        return lb if mult is None else min(ceiling, lb * mult)
+
+    def evaluate(self, lb: float, ceiling: float, carrier_offer: float, round_num: int) -> dict:
+        if carrier_offer <= lb:
+            decision, broker_offer = "accept", carrier_offer
+            reason = "At or below listed rate — good margin."
+        elif carrier_offer <= ceiling:
+            decision, broker_offer = "accept", carrier_offer
+            reason = "Slightly above listed rate but within allowed bump."
+        else:
+            reason = "Counter offer above acceptable ceiling."
+            broker_offer = self.counter(lb, ceiling, round_num)
+            if broker_offer is not None:
+                decision = "counter"
+            else:
+                decision, broker_offer = "reject", lb
+        return {
+            "decision": decision,
+            "broker_offer": round(broker_offer, 2),
+            "ceiling": round(ceiling, 2),
+            "listed_rate": lb,
+            "reason": reason
+        }
+
+    def evaluate_many(self, lb, ceiling, offers, round_num: int) -> tuple:
+        """``evaluate`` over NumPy arrays: (accepted mask, counter), counter NaN where rejected."""
+        import numpy as np
+        if type(self).evaluate is not Policy.evaluate:  # custom rules: fall back to the scalar ones
+            out = [self.evaluate(float(l), float(c), float(o), round_num) for l, c, o in zip(lb, ceiling, offers)]
+            return (np.array([r["decision"] == "accept" for r in out], dtype=bool),
+                    np.array([r["broker_offer"] if r["decision"] == "counter" else np.nan for r in out]))
+        accepted = offers <= np.maximum(lb, ceiling)
+        if round_num not in self.round_counters:
+            return accepted, np.full(len(offers), np.nan)
+        mult = self.round_counters[round_num]
+        counter = lb if mult is None else np.minimum(ceiling, lb * mult)
+        return accepted, np.round(np.where(accepted, np.nan, counter), 2)
+
+    def ladder(self, lb: float, ceiling: float, urgent_ceiling: float) -> dict:
+        """Every answer ``evaluate`` can give for one load, so a client can negotiate without calling back."""
+        def counters(c):
+            return {str(r): round(self.counter(lb, c, r), 2) for r in self.round_counters}
+        return {
+            "listed_rate": lb,
+            "ceiling": round(ceiling, 2),  # accept any offer at or below this
+            "counters": counters(ceiling),  # by round, when the offer is above the ceiling
+            "urgent_ceiling": round(urgent_ceiling, 2),
+            "urgent_counters": counters(urgent_ceiling),
+            "reject_after_round": self.last_round,
+        }
+
+
+POLICY = Policy()
+ceilings, evaluate, ladder = POLICY.ceilings, POLICY.evaluate, POLICY.ladder
@@ -0,0 +1,71 @@
+"""Azure Table partition keys for call logs.
+
+Every entity used to land in the single ``CallLogs`` partition, and one
+partition is served by one node with a capped throughput. Keys are now
+
+    CallLogs-<yyyymmdd>-<shard>      call fields
+    Transcripts-<yyyymmdd>-<shard>   zlib + base64 transcript, same RowKey
+
+The day comes from the call's own timestamp (UTC), and the shard is a
+stable hash of the RowKey, so a webhook retry lands on the same entity.
+Writes for one day spread over ``shards`` partitions. A time-range read
+is a point query per (day, shard) partition, not a table scan. Calls
+without a parseable timestamp go to ``<prefix>-undated-<shard>``.
+"""
+import base64, zlib
+from datetime import datetime, timedelta, timezone
+
+CALLS = "CallLogs"
+TRANSCRIPTS = "Transcripts"
+UNDATED = "undated"
+CHUNK_CHARS = 32000  # Azure string properties hold 64 KiB of UTF-16
+
+
+def day_of(timestamp) -> str:
+    try:
+        dt = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+    except ValueError:
+        return UNDATED
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).strftime("%Y%m%d")
+
+
+def shard_of(row_key: str, shards: int) -> int:
+    return zlib.crc32(row_key.encode()) % shards  # stable across processes, unlike hash()
+
+
+def partition_key(prefix: str, timestamp, row_key: str, shards: int) -> str:
+    return f"{prefix}-{day_of(timestamp)}-{shard_of(row_key, shards):02d}"
+
+
+def transcript_entity(entity: dict, transcript: str, shards: int) -> dict:
+    """Companion entity holding the compressed transcript, chunked into string properties."""
+    z = base64.b64encode(zlib.compress(transcript.encode())).decode()
+    out = {"PartitionKey": partition_key(TRANSCRIPTS, entity.get("timestamp"), entity["RowKey"], shards),
+           "RowKey": entity["RowKey"], "chunks": -(-len(z) // CHUNK_CHARS)}
+    for i in range(out["chunks"]):
+        out[f"z{i}"] = z[i * CHUNK_CHARS:(i + 1) * CHUNK_CHARS]
+    return out
+
+
+def read_transcript(entity: dict) -> str:
+    z = "".join(entity[f"z{i}"] for i in range(entity["chunks"]))
+    return zlib.decompress(base64.b64decode(z)).decode()
+
+
+def partitions_for(prefix: str, t0: float, t1: float, shards: int) -> list:
+    """Partition keys covering the UTC days of [t0, t1)."""
+    day = datetime.fromtimestamp(t0, timezone.utc).date()
+    last = datetime.fromtimestamp(max(t0, t1 - 1), timezone.utc).date()
+    out = []
+    while day <= last:
+        out += [f"{prefix}-{day:%Y%m%d}-{s:02d}" for s in range(shards)]
+        day += timedelta(days=1)
+    return out
+
+
+def read_range(table_client, t0: float, t1: float, shards: int, prefix: str = CALLS):
+    """Entities for calls in the UTC days of [t0, t1), one partition query at a time."""
+    for pk in partitions_for(prefix, t0, t1, shards):
+        yield from table_client.query_entities(f"PartitionKey eq '{pk}'")
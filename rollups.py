@@ -0,0 +1,156 @@
+"""Incrementally maintained metric rollups for /metrics.json.
+
+AFTER INSERT triggers on ``calls`` bump small bucket tables in the same
+transaction as the insert, so every writer (any worker process, any code
+path) keeps them current and /metrics.json reads O(buckets) rows instead of
+scanning call history. Deleting calls (e.g. archival) leaves the rollups
+untouched on purpose: they are all-time totals.
+
+Rebuild from the raw table with:
+
+    python rollups.py backfill [calls.db]
+
+A backfill counts only rows still in ``calls``: days already moved out by
+the retention job (archive.py) drop out of the totals.
+"""
+import os, sqlite3, sys
+
+WIN_OUTCOME = "agreed_and_transferred"
+
+ROLLUP_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS rollup_outcome (
+        outcome TEXT PRIMARY KEY, calls INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_sentiment (
+        sentiment TEXT PRIMARY KEY, calls INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_daily (
+        day TEXT PRIMARY KEY, calls INTEGER NOT NULL, wins INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_equipment (
+        equipment_type TEXT PRIMARY KEY, calls INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_rate_delta (
+        id INTEGER PRIMARY KEY CHECK (id = 0), calls INTEGER NOT NULL, total REAL NOT NULL
+    );
+
+    CREATE TRIGGER IF NOT EXISTS calls_rollup AFTER INSERT ON calls BEGIN
+        INSERT INTO rollup_outcome (outcome, calls)
+            VALUES (COALESCE(NULLIF(NEW.outcome, ''), 'unknown'), 1)
+            ON CONFLICT (outcome) DO UPDATE SET calls = calls + 1;
+        INSERT INTO rollup_sentiment (sentiment, calls)
+            VALUES (COALESCE(NULLIF(NEW.sentiment, ''), 'unknown'), 1)
+            ON CONFLICT (sentiment) DO UPDATE SET calls = calls + 1;
+        INSERT INTO rollup_daily (day, calls, wins)
+            VALUES (COALESCE(substr(NEW.timestamp, 1, 10), ''), 1, NEW.outcome IS '{WIN_OUTCOME}')
+            ON CONFLICT (day) DO UPDATE SET calls = calls + 1, wins = wins + excluded.wins;
+        INSERT INTO rollup_equipment (equipment_type, calls)
+            SELECT NEW.equipment_type, 1 WHERE NEW.equipment_type IS NOT NULL
+            ON CONFLICT (equipment_type) DO UPDATE SET calls = calls + 1;
+        INSERT INTO rollup_rate_delta (id, calls, total)
+            SELECT 0, 1, NEW.agreed_rate - NEW.loadboard_rate
+            WHERE NEW.agreed_rate IS NOT NULL AND NEW.loadboard_rate IS NOT NULL
+            ON CONFLICT (id) DO UPDATE SET calls = calls + 1, total = total + excluded.total;
+    END;
+"""
+
+BACKFILL_SQL = f"""
+    DELETE FROM rollup_outcome;
+    DELETE FROM rollup_sentiment;
+    DELETE FROM rollup_daily;
+    DELETE FROM rollup_equipment;
+    DELETE FROM rollup_rate_delta;
+    INSERT INTO rollup_outcome
+        SELECT COALESCE(NULLIF(outcome, ''), 'unknown') k, COUNT(*) FROM calls GROUP BY k;
+    INSERT INTO rollup_sentiment
+        SELECT COALESCE(NULLIF(sentiment, ''), 'unknown') k, COUNT(*) FROM calls GROUP BY k;
+    INSERT INTO rollup_daily
+        SELECT COALESCE(substr(timestamp, 1, 10), '') d, COUNT(*), SUM(outcome IS '{WIN_OUTCOME}')
+        FROM calls GROUP BY d;
+    INSERT INTO rollup_equipment
+        SELECT equipment_type, COUNT(*) FROM calls WHERE equipment_type IS NOT NULL GROUP BY equipment_type;
+    INSERT INTO rollup_rate_delta
+        SELECT 0, n, total FROM (
+            SELECT COUNT(*) n, SUM(agreed_rate - loadboard_rate) total FROM calls
+            WHERE agreed_rate IS NOT NULL AND loadboard_rate IS NOT NULL
+        ) WHERE n > 0;
+"""
+
+
+def _statements(script: str) -> list:
+    # sqlite3.executescript would COMMIT our open transaction; run one statement at a time
+    out, buf = [], ""
+    for line in script.strip().splitlines():
+        buf += line + "\n"
+        if sqlite3.complete_statement(buf):
+            out.append(buf.strip()); buf = ""
+    return out
+
+
+def install(con):
+    """Create rollup tables/trigger; backfill when they are new. Call inside a write transaction."""
+    existed = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_outcome'").fetchone()
+    for stmt in _statements(ROLLUP_SCHEMA):
+        con.execute(stmt)
+    if not existed:
+        backfill(con)
+
+
+def backfill(con):
+    for stmt in _statements(BACKFILL_SQL):
+        con.execute(stmt)
+
+
+def read_metrics(con) -> dict:
+    by_outcome = {r["outcome"]: r["calls"] for r in con.execute("SELECT outcome, calls FROM rollup_outcome")}
+    by_sentiment = {r["sentiment"]: r["calls"] for r in con.execute("SELECT sentiment, calls FROM rollup_sentiment")}
+    daily = [{"date": r["day"] or None, "calls": r["calls"], "wins": r["wins"]}
+             for r in con.execute("SELECT day, calls, wins FROM rollup_daily ORDER BY day")]
+    by_equipment = {r["equipment_type"]: r["calls"]
+                    for r in con.execute("SELECT equipment_type, calls FROM rollup_equipment")}
+    row = con.execute("SELECT calls, total FROM rollup_rate_delta WHERE id = 0").fetchone()
+    avg_delta = row["total"] / row["calls"] if row and row["calls"] else 0.0
+    return {"by_outcome": by_outcome, "by_sentiment": by_sentiment,
+            "daily": daily, "by_equipment": by_equipment, "avg_rate_delta": round(avg_delta, 2),
+            "rate_delta": {"calls": row["calls"] if row else 0, "total": row["total"] if row else 0.0}}
+
+
+def delta(rows: list) -> dict:
+    """What the trigger adds to the rollups for these ``INSERT_CALL_SQL`` row tuples."""
+    by_outcome, by_sentiment, daily, by_equipment = {}, {}, {}, {}
+    rate_calls, rate_total = 0, 0.0
+    for r in rows:
+        outcome, sentiment, equipment, listed, agreed = r[2], r[3], r[13], r[15], r[16]
+        k = outcome or "unknown"
+        by_outcome[k] = by_outcome.get(k, 0) + 1
+        k = sentiment or "unknown"
+        by_sentiment[k] = by_sentiment.get(k, 0) + 1
+        day = daily.setdefault(str(r[1])[:10] if r[1] is not None else "", [0, 0])
+        day[0] += 1
+        day[1] += outcome == WIN_OUTCOME
+        if equipment is not None:
+            by_equipment[equipment] = by_equipment.get(equipment, 0) + 1
+        if agreed is not None and listed is not None:
+            try:  # webhook values may be numeric strings; the REAL columns store them as numbers
+                diff = float(agreed) - float(listed)
+            except (TypeError, ValueError):
+                continue
+            rate_calls += 1
+            rate_total += diff
+    return {"by_outcome": by_outcome, "by_sentiment": by_sentiment,
+            "daily": [{"date": d or None, "calls": c, "wins": w} for d, (c, w) in sorted(daily.items())],
+            "by_equipment": by_equipment, "rate_delta": {"calls": rate_calls, "total": rate_total}}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        sys.exit("usage: python rollups.py backfill [db_path]")
+    from store import CallStore
+    store = CallStore(sys.argv[2] if len(sys.argv) > 2 else os.getenv("DB_PATH", "calls.db"))
+    store.init_schema()
+    with store.transaction() as con:
+        backfill(con)
+    with store.reader() as con:
+        print(read_metrics(con))
+    store.close()
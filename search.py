@@ -0,0 +1,278 @@
+"""Indexed top-k load search.
+
+Scoring mirrors ``score``, the original per-request scorer over raw load
+dicts: equipment +5, origin +3, destination +3, pickup inside the window
++2, short haul (<= 750 mi) +1. Ties keep catalog order, exactly like the
+stable ``sorted`` the endpoint used to run.
+"""
+import heapq
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from catalog import Catalog
+from geo import CityGrid
+
+W_EQUIP, W_ORIGIN, W_DEST, W_WINDOW, W_SHORT = 5, 3, 3, 2, 1  # origin and destination weigh the same
+SHORT_HAUL_MILES = 750
+LANE_LOOKUPS = 4096  # above this many (origin, destination) pairs, walk origin postings instead
+
+
+def pair(a: int, b: int) -> int:
+    """One int key for two codes (each below 2**20)."""
+    return a << 20 | b
+
+
+# postings name -> key of a position
+POSTING_KEYS = {
+    "by_origin": lambda c, p: c.origin[p],
+    "by_dest": lambda c, p: c.dest[p],
+    "by_equip": lambda c, p: c.equip[p],
+    "by_lane": lambda c, p: pair(c.origin[p], c.dest[p]),
+    "by_origin_equip": lambda c, p: pair(c.origin[p], c.equip[p]),
+    "by_dest_equip": lambda c, p: pair(c.dest[p], c.equip[p]),
+}
+# pickup-ordered (times, positions) copies: name -> the postings they order
+DEPARTURES = {
+    "departures_by_origin": "by_origin",
+    "departures_by_dest": "by_dest",
+    "departures_by_origin_equip": "by_origin_equip",
+    "departures_by_dest_equip": "by_dest_equip",
+}
+
+
+def score(load: dict, origin: str, destination: str, equipment: str, w0: datetime, w1: datetime) -> int:
+    """Reference scorer (what /search_loads ran before the indexes); parity checks rank with it."""
+    city = lambda s: s.split(",")[0].strip().lower()
+    s = 0
+    if load["equipment_type"].lower() == equipment.lower(): s += 5
+    if city(load["origin"]) == city(origin): s += 3
+    if city(load["destination"]) == city(destination): s += 3
+    if w0 <= datetime.fromisoformat(load["pickup_datetime"]) <= w1: s += 2
+    if load.get("miles", 99999) <= 750: s += 1
+    return s
+
+
+class LoadIndex:
+    """Inverted indexes on origin/destination/equipment (and their pairs) plus pickup-time indexes."""
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self.loads = catalog.sources
+        self.dead = frozenset()
+        self.short = bytearray(m <= SHORT_HAUL_MILES for m in catalog.miles)
+        for name, key in POSTING_KEYS.items():
+            postings = {}
+            for pos in range(len(catalog)):
+                postings.setdefault(key(catalog, pos), []).append(pos)
+            setattr(self, name, postings)
+        self.pickup_order = sorted(range(len(catalog)), key=catalog.pickup.__getitem__)
+        self.pickup_sorted = [catalog.pickup[p] for p in self.pickup_order]
+        for name, of in DEPARTURES.items():
+            setattr(self, name, {key: self._by_pickup(ps) for key, ps in getattr(self, of).items()})
+        self._build_grids()
+
+    def _build_grids(self):
+        points = self.catalog.place_points
+        self.origin_grid = CityGrid({c: points[c] for c, ps in self.by_origin.items() if ps and c in points})
+        self.dest_grid = CityGrid({c: points[c] for c, ps in self.by_dest.items() if ps and c in points})
+
+    def _by_pickup(self, positions: list) -> tuple:
+        order = sorted(positions, key=self.catalog.pickup.__getitem__)
+        return [self.catalog.pickup[p] for p in order], order
+
+    def __len__(self):
+        return len(self.catalog) - len(self.dead)
+
+    def patched(self, catalog: Catalog, removed: list, changed: list, added: list) -> "LoadIndex":
+        """New index over ``catalog`` (a patched copy of ours), sharing untouched postings.
+
+        ``removed`` are positions tombstoned in ``catalog``, ``changed`` were replaced in
+        place and ``added`` were appended. Every list stays in position order, and equal
+        pickups stay in position order, exactly as a full build over the same loads.
+        """
+        old, gone, moved = self.catalog, set(removed), set(changed)
+        out = gone | moved
+        idx = LoadIndex.__new__(LoadIndex)
+        idx.catalog, idx.loads = catalog, catalog.sources
+        idx.dead = self.dead | gone
+        idx.short = self.short + bytearray(catalog.miles[p] <= SHORT_HAUL_MILES for p in added)
+        for p in changed:
+            idx.short[p] = catalog.miles[p] <= SHORT_HAUL_MILES
+        touched = {}
+        for name, key in POSTING_KEYS.items():
+            postings = dict(getattr(self, name))
+            fresh = {}
+            for p in changed + added:
+                fresh.setdefault(key(catalog, p), []).append(p)
+            touched[name] = {key(old, p) for p in out} | set(fresh)
+            for k in touched[name]:
+                postings[k] = sorted([p for p in postings.get(k, ()) if p not in out] + fresh.get(k, []))
+            setattr(idx, name, postings)
+        order, keys = list(self.pickup_order), list(self.pickup_sorted)
+        for p in out:
+            t = old.pickup[p]
+            i = bisect_left(order, p, bisect_left(keys, t), bisect_right(keys, t))
+            del order[i], keys[i]
+        for p in changed + added:
+            t = catalog.pickup[p]
+            i = bisect_left(order, p, bisect_left(keys, t), bisect_right(keys, t))
+            keys.insert(i, t); order.insert(i, p)
+        idx.pickup_order, idx.pickup_sorted = order, keys
+        for name, of in DEPARTURES.items():
+            departures = dict(getattr(self, name))
+            for k in touched[of]:
+                departures[k] = idx._by_pickup(getattr(idx, of)[k])
+            setattr(idx, name, departures)
+        idx._build_grids()
+        return idx
+
+    def window(self, t0: float, t1: float) -> list:
+        """Positions whose pickup falls in [t0, t1], in pickup-time order."""
+        return self.pickup_order[bisect_left(self.pickup_sorted, t0):bisect_right(self.pickup_sorted, t1)]
+
+    def departures(self, place: int, t0: float, t1: float) -> list:
+        """Positions leaving ``place`` (a place code) with pickup in [t0, t1], earliest first."""
+        times, order = self.departures_by_origin.get(place, ((), ()))
+        return order[bisect_left(times, t0):bisect_right(times, t1)]
+
+    def score_at(self, pos: int, o, d, e: int, t0: float, t1: float) -> int:
+        """Score of one load; ``o``/``d`` are collections of matching place codes."""
+        c = self.catalog
+        s = W_EQUIP if c.equip[pos] == e else 0
+        if c.origin[pos] in o: s += W_ORIGIN
+        if c.dest[pos] in d: s += W_DEST
+        if t0 <= c.pickup[pos] <= t1: s += W_WINDOW
+        if self.short[pos]: s += W_SHORT
+        return s
+
+    def near(self, grid: CityGrid, point, radius_miles: float) -> dict:
+        """{place code: miles} within the radius of ``point`` ((lat, lon) or None)."""
+        return grid.within(point[0], point[1], radius_miles) if point is not None else {}
+
+    def targets(self, city_state: str, near: dict = None) -> dict:
+        """{place code: miles} a load's origin/destination must be in to score.
+
+        Exact: every place with the city's name. A radius adds the places ``near`` selected;
+        same-name places it missed (not geocoded, or out of range) still count, at infinite distance.
+        """
+        exact = self.catalog.places_named(city_state)
+        if near is None:
+            return dict.fromkeys(exact, 0.0)
+        return {**dict.fromkeys(exact, float("inf")), **near}
+
+    def top_k(self, origin: str, destination: str, equipment: str,
+              t0: float, t1: float, k: int = 3, origin_near: dict = None, dest_near: dict = None) -> list:
+        """Positions of the k best loads, best first.
+
+        Loads matching both origin and destination (a few lane postings) are
+        scored outright. Everything else is walked in tiers of one base score
+        (only the short-haul bit varies inside a tier), highest first, and a
+        tier is only opened while it can still beat (or tie) the current k-th
+        best. Each tier is a merge of small, rank-ordered streams: per-place
+        (place, equipment) postings, their pickup-ordered copies for window
+        tiers, or the equipment / pickup indexes for loads matching neither
+        end, so a tier stops after k short hauls.
+
+        ``origin_near`` / ``dest_near`` ({place code: miles}, see ``near``)
+        widen exact city matching to a radius (see ``targets``); with
+        ``origin_near`` ties are broken by deadhead distance before catalog
+        order.
+        """
+        c = self.catalog
+        if k <= 0 or not len(c):
+            return []
+        e = c.equip_code(equipment)
+        o, d = self.targets(origin, origin_near), self.targets(destination, dest_near)
+        origin_, dest, equip, pickup, short = c.origin, c.dest, c.equip, c.pickup, self.short
+        far = float("inf")
+        rank = (lambda p: (o.get(origin_[p], far), p)) if origin_near is not None else None
+        in_win = lambda p: t0 <= pickup[p] <= t1
+        lo, hi = bisect_left(self.pickup_sorted, t0), bisect_right(self.pickup_sorted, t1)
+
+        cands = {}
+        if len(o) * len(d) <= LANE_LOOKUPS:
+            both = (p for a in o for b in d for p in self.by_lane.get(pair(a, b), ()))
+        else:
+            both = (p for a in o for p in self.by_origin.get(a, ()) if dest[p] in d)
+        for p in both:
+            cands[p] = self.score_at(p, o, d, e, t0, t1)
+
+        def end_stream(postings, departures, keep, with_w: bool):
+            if not with_w:
+                return (p for p in postings if keep(p) and not in_win(p))
+            times, order = departures
+            i, j = bisect_left(times, t0), bisect_right(times, t1)
+            if (j - i) * 4 < len(postings):  # few in the window: sort them, else filter in order
+                return sorted(p for p in order[i:j] if keep(p))
+            return (p for p in postings if keep(p) and in_win(p))
+
+        def one_end(with_e: bool, with_w: bool):
+            """Loads matching exactly one end, by place, in rank order."""
+            streams = []
+            for places, name, other, col in ((o, "origin", d, dest), (d, "dest", o, origin_)):
+                if with_e:
+                    postings, departures = getattr(self, f"by_{name}_equip"), getattr(self, f"departures_by_{name}_equip")
+                    keep = lambda p, other=other, col=col: col[p] not in other
+                else:
+                    postings, departures = getattr(self, f"by_{name}"), getattr(self, f"departures_by_{name}")
+                    keep = lambda p, other=other, col=col: col[p] not in other and equip[p] != e
+                for place in places:
+                    key = pair(place, e) if with_e else place
+                    streams.append(end_stream(postings.get(key, ()), departures.get(key, ((), ())), keep, with_w))
+            return heapq.merge(*streams, key=rank)
+
+        def neither(with_e: bool, with_w: bool):
+            rest = lambda p: origin_[p] not in o and dest[p] not in d
+            postings = self.by_equip.get(e, ())
+            if with_e and with_w:
+                if hi - lo < len(postings):
+                    return sorted(p for p in self.pickup_order[lo:hi] if equip[p] == e and rest(p))
+                return (p for p in postings if in_win(p) and rest(p))
+            if with_e:
+                return (p for p in postings if not in_win(p) and rest(p))
+            if with_w:
+                return sorted(p for p in self.pickup_order[lo:hi] if equip[p] != e and rest(p))
+            dead = self.dead
+            return (p for p in range(len(c)) if equip[p] != e and not in_win(p) and rest(p) and p not in dead)
+
+        def kth_best():
+            if len(cands) < k:
+                return -1
+            return -heapq.nsmallest(k, ((-s, p) for p, s in cands.items()))[-1][0]
+
+        def take(positions, base):
+            # positions arrive in rank order and only the short-haul bit varies
+            # inside a tier, so stop once k loads carry it
+            hits = misses = 0
+            for p in positions:
+                if short[p]:
+                    cands[p] = base + W_SHORT; hits += 1
+                    if hits >= k:
+                        return
+                elif misses < k:
+                    cands[p] = base; misses += 1
+
+        tiers = {}
+        for base, make, args in ((W_EQUIP + W_ORIGIN + W_WINDOW, one_end, (True, True)),
+                                 (W_EQUIP + W_ORIGIN, one_end, (True, False)),
+                                 (W_EQUIP + W_WINDOW, neither, (True, True)),
+                                 (W_EQUIP, neither, (True, False)),
+                                 (W_ORIGIN + W_WINDOW, one_end, (False, True)),
+                                 (W_ORIGIN, one_end, (False, False)),
+                                 (W_WINDOW, neither, (False, True)),
+                                 (0, neither, (False, False))):
+            tiers.setdefault(base, []).append((make, args))
+        for base in sorted(tiers, reverse=True):
+            if kth_best() > base + W_SHORT:
+                break
+            streams = [make(*args) for make, args in tiers[base]]
+            take(streams[0] if len(streams) == 1 else heapq.merge(*streams, key=rank), base)
+
+        if origin_near is not None:
+            return [p for _, _, p in heapq.nsmallest(
+                k, ((-s, o.get(origin_[p], far), p) for p, s in cands.items()))]
+        return [p for _, p in heapq.nsmallest(k, ((-s, p) for p, s in cands.items()))]
+
+    def search(self, origin: str, destination: str, equipment: str,
+               t0: float, t1: float, k: int = 3) -> list:
+        return [self.loads[p] for p in self.top_k(origin, destination, equipment, t0, t1, k)]
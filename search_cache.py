@@ -0,0 +1,83 @@
+"""Result cache for /search_loads.
+
+During a call, and across calls on popular lanes, the agent repeats nearly
+the same criteria with the pickup window nudged a little. The key is the
+criteria normalized against the catalog:
+
+* origin, destination and equipment become catalog codes (city name codes
+  for origin and destination). Every name the catalog does not know maps
+  to -1, and they all rank the same.
+* A radius search keys on the exact {place code: miles} set the radius
+  selects, not on the raw point, plus the name code.
+* The pickup window is bucketed by the loads it contains: the
+  ``pickup_sorted`` index range ``[bisect_left(t0), bisect_right(t1))``.
+  Two windows that cover the same pickups score every load the same, so
+  shifted windows share an entry and a hit is always what a fresh search
+  would return.
+
+Entries belong to one catalog snapshot. The first lookup against a newer
+snapshot drops them all, so a reload invalidates exactly when the catalog
+changes. Size is bounded by an LRU, and a TTL ages out idle entries.
+"""
+import threading, time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+def key_for(index, origin: str, destination: str, equipment: str, t0: float, t1: float, k: int,
+            origin_near: dict = None, dest_near: dict = None) -> tuple:
+    c = index.catalog
+    o, d = c.name_code(origin), c.name_code(destination)
+    if origin_near is not None:
+        o = (o, frozenset(origin_near.items()))
+    if dest_near is not None:
+        d = (d, frozenset(dest_near.items()))
+    return (o, d, c.equip_code(equipment),
+            bisect_left(index.pickup_sorted, t0), bisect_right(index.pickup_sorted, t1), k)
+
+
+class SearchCache:
+    def __init__(self, maxsize: int = 4096, ttl_seconds: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def _check_snapshot(self, snapshot):
+        if snapshot is not self._snapshot:
+            if self._entries:
+                self.counts["invalidations"] += 1
+            self._entries.clear()
+            self._snapshot = snapshot
+
+    def get(self, snapshot, key):
+        with self._lock:
+            self._check_snapshot(snapshot)
+            hit = self._entries.get(key)
+            if hit is not None:
+                if time.monotonic() - hit[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.counts["hits"] += 1
+                    return hit[1]
+                del self._entries[key]
+                self.counts["expired"] += 1
+            self.counts["misses"] += 1
+            return None
+
+    def put(self, snapshot, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_snapshot(snapshot)
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def stats(self) -> dict:
+        lookups = self.counts["hits"] + self.counts["misses"]
+        return {**self.counts, "size": len(self._entries), "maxsize": self.maxsize,
+                "hit_rate": round(self.counts["hits"] / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,267 @@
+"""Offline negotiation simulator: replay or synthesize offers through pricing policies.
+
+Every scenario is one carrier negotiating one load with ``negotiation.Policy``,
+the same objects /evaluate_counter uses. The carrier model:
+
+* a reservation price ``reserve`` (the lowest rate it will haul for) and an
+  opening ask ``ask``;
+* in round k it offers ``reserve + (ask - reserve) * concede ** (k - 1)``;
+* the broker accepts an offer at or below the ceiling, else counters; the
+  carrier takes a counter at or above its reservation, else goes again;
+* once the policy's rounds are used up the broker rejects.
+
+``synthetic`` draws all of that at random (listed rates from loads.json
+when given). ``replay`` reads logged calls, so the live policy reproduces
+each logged outcome. A ``counter_declined`` call puts the reservation a
+random 1-10% above what the live policy accepts (so above all its counters
+too), with a sampled ask and concession. A won call is constrained so the
+live policy closes it at the logged agreed rate (``won_behaviour``): the
+carrier either takes the live counter equal to it, or its offer reaches it
+in the logged round after it declined every earlier counter. Calls without a
+negotiation (no match, unqualified) are skipped.
+
+Scenarios are simulated as NumPy arrays, one array op per round per policy,
+in chunks spread over a process pool. Results are win rate and broker
+margin (listed rate minus agreed rate), with deltas against the first policy
+(the live one unless ``--baseline`` names another).
+
+    python simulate.py synthetic --n 5000000 --workers 8 --policies policies.json
+    python simulate.py replay [calls.db] --policies policies.json
+
+``policies.json`` is a list of ``Policy.from_spec`` dicts, e.g.
+``[{"name": "tight", "ceiling_bump": 0.10, "round_counters": {"1": null, "2": 1.04, "3": 1.07}}]``.
+"""
+import argparse, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+import negotiation
+from negotiation import Policy
+
+CHUNK = 500_000
+LOST_GAP = (0.01, 0.10)  # reservation above the live acceptance cap, for declined calls
+STAT_KEYS = ["calls", "wins", "rounds", "margin"]
+
+
+# ---------- scenarios ----------
+def carrier_behaviour(rng, reserve):
+    """(ask, concede) around a reservation price."""
+    ask = reserve * (1 + rng.uniform(0.03, 0.30, len(reserve)))
+    return ask, rng.uniform(0.3, 0.9, len(reserve))
+
+
+def won_behaviour(rng, policy: Policy, lb, ceiling, agreed, rounds) -> tuple:
+    """(reserve, ask, concede) under which ``policy`` closes each won call at ``agreed``.
+
+    Where a counter equals ``agreed``, the carrier offers above the acceptance cap until that round
+    and takes it (reserve = agreed). Otherwise its offer reaches ``agreed`` in the logged round (or
+    the latest earlier one whose preceding counters are all below ``agreed``), with the reservation
+    above those counters. Calls the policy cannot close at ``agreed`` keep the sampled behaviour.
+    """
+    ask, concede = carrier_behaviour(rng, agreed)
+    reserve = agreed.copy()
+    cap = np.maximum(lb, ceiling)
+    closable = agreed <= cap
+    counters = [np.round(lb if m is None else np.minimum(ceiling, lb * m), 2)
+                for _, m in sorted(policy.round_counters.items())]
+    # prior[k - 1]: the best counter before round k
+    prior = [np.full(len(lb), -np.inf)]
+    for c in counters[:-1]:
+        prior.append(np.maximum(prior[-1], c))
+
+    by_counter = np.zeros(len(lb), dtype=bool)
+    for k, c in enumerate(counters, 1):
+        hit = closable & ~by_counter & (np.abs(c - agreed) < 0.005) & (prior[k - 1] < agreed)
+        gap = (cap - agreed + cap * rng.uniform(0.03, 0.30, len(lb)))[hit]  # offer k still above the cap
+        ask[hit] = agreed[hit] + gap / concede[hit] ** (k - 1)
+        by_counter |= hit
+
+    k = np.clip(np.nan_to_num(rounds, nan=1), 1, len(counters)).astype(np.int64)
+    for r in range(len(counters), 1, -1):
+        k[(k == r) & (prior[r - 1] >= agreed)] = r - 1
+    first = closable & ~by_counter & (k == 1)
+    ask[first] = agreed[first]
+    later = np.flatnonzero(closable & ~by_counter & (k > 1))
+    k, a, top = k[later], agreed[later], cap[later]
+    lo = np.stack(prior)[k - 1, later]
+    res = lo + (a - lo) * rng.uniform(0.05, 0.95, len(a))
+    c = concede[later] * (a - res) / (top - res)  # so offer k - 1 = res + (a - res) / c clears the cap
+    reserve[later], concede[later], ask[later] = res, c, res + (a - res) / c ** (k - 1)
+    return reserve, ask, concede
+
+
+def synthetic(n: int, seed: int, rates=None) -> dict:
+    rng = np.random.default_rng(seed)
+    lb = rng.choice(rates, n) if rates is not None else np.round(rng.lognormal(7.3, 0.45, n), -1)
+    reserve = lb * np.clip(rng.normal(1.06, 0.07, n), 0.7, None)
+    ask, concede = carrier_behaviour(rng, reserve)
+    return {"lb": lb, "reserve": reserve, "ask": ask, "concede": concede, "urgent": rng.random(n) < 0.2}
+
+
+def _epoch(s):
+    try:
+        dt = datetime.fromisoformat(str(s).replace("Z", "+00:00"))
+    except ValueError:
+        return np.nan
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def replay(store, seed: int, live: Policy = negotiation.POLICY):
+    """Scenario chunks from the ``calls`` table, read with the export's keyset paging."""
+    import export
+    rng = np.random.default_rng(seed)
+    cols = ["id", "loadboard_rate", "agreed_rate", "outcome", "ts", "pickup_datetime", "rounds"]
+    start, end = export.id_bounds(store)
+    lb, agreed, pickup, ts, rounds = [], [], [], [], []
+    for page in export.rows(store, cols, start, end, chunk=10_000):
+        for _, rate, agreed_rate, outcome, t, p, r in page:
+            if not rate or (agreed_rate is None and outcome != "counter_declined"):
+                continue
+            lb.append(rate); agreed.append(np.nan if agreed_rate is None else agreed_rate)
+            ts.append(np.nan if t is None else t); pickup.append(_epoch(p))
+            rounds.append(r if isinstance(r, (int, float)) else np.nan)
+    if not lb:
+        return
+    lb, agreed, rounds = np.array(lb, dtype=float), np.array(agreed), np.array(rounds, dtype=float)
+    urgent = np.array(pickup) - np.array(ts) <= negotiation.URGENT_SECONDS  # as Catalog.ceiling_at
+    regular, urgent_c = live.ceilings(lb)
+    ceiling = np.where(urgent, urgent_c, regular)
+    # declined: every live counter was too low and no offer came under the cap
+    reserve = np.maximum(lb, ceiling) * (1 + rng.uniform(*LOST_GAP, len(lb)))
+    ask, concede = carrier_behaviour(rng, reserve)
+    won = ~np.isnan(agreed)
+    reserve[won], ask[won], concede[won] = won_behaviour(rng, live, lb[won], ceiling[won], agreed[won], rounds[won])
+    for i in range(0, len(lb), CHUNK):
+        s = slice(i, i + CHUNK)
+        yield {"lb": lb[s], "reserve": reserve[s], "ask": ask[s], "concede": concede[s], "urgent": urgent[s]}
+
+
+# ---------- simulation ----------
+def negotiate(policy: Policy, sc: dict) -> tuple:
+    """(agreed price, NaN where lost; round it closed in) for every scenario."""
+    lb, reserve, ask, concede = sc["lb"], sc["reserve"], sc["ask"], sc["concede"]
+    regular, urgent = policy.ceilings(lb)
+    ceiling = np.where(sc["urgent"], urgent, regular)
+    price = np.full(len(lb), np.nan)
+    rounds = np.zeros(len(lb), dtype=np.int64)
+    open_ = np.ones(len(lb), dtype=bool)
+    for k in range(1, policy.last_round + 2):  # the round after the last counter is the reject
+        offer = reserve + (ask - reserve) * concede ** (k - 1)
+        accepted, counter = policy.evaluate_many(lb, ceiling, offer, k)
+        took = open_ & accepted
+        price[took], rounds[took] = offer[took], k
+        open_ &= ~accepted
+        taken = open_ & (counter >= reserve)  # NaN (rejected) compares False
+        price[taken], rounds[taken] = counter[taken], k
+        open_ &= ~taken & ~np.isnan(counter)
+        if not open_.any():
+            break
+    return price, rounds
+
+
+def summarize(policy: Policy, sc: dict) -> dict:
+    price, rounds = negotiate(policy, sc)
+    won = ~np.isnan(price)
+    return {"calls": len(price), "wins": int(won.sum()), "rounds": int(rounds[won].sum()),
+            "margin": float((sc["lb"][won] - price[won]).sum())}
+
+
+def _synthetic_chunk(policies, n, seed, rates):
+    sc = synthetic(n, seed, rates)
+    return [summarize(p, sc) for p in policies]
+
+
+def _scenario_chunk(policies, sc):
+    return [summarize(p, sc) for p in policies]
+
+
+def run(policies: list, chunks, workers: int) -> list:
+    """Sum per-policy stats over ``chunks`` of (function, args) run in a process pool."""
+    totals = [dict.fromkeys(STAT_KEYS, 0) for _ in policies]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_call, chunks):
+            for t, r in zip(totals, result):
+                for k in STAT_KEYS:
+                    t[k] += r[k]
+    return totals
+
+
+def _call(job):
+    fn, args = job
+    return fn(*args)
+
+
+def report(policies: list, totals: list) -> list:
+    rows = []
+    for p, t in zip(policies, totals):
+        rows.append({"policy": p.name, "spec": p.spec(), "calls": t["calls"], "wins": t["wins"],
+                     "win_rate": round(t["wins"] / t["calls"], 4) if t["calls"] else 0.0,
+                     "margin_total": round(t["margin"], 2),
+                     "margin_per_call": round(t["margin"] / t["calls"], 2) if t["calls"] else 0.0,
+                     "margin_per_win": round(t["margin"] / t["wins"], 2) if t["wins"] else 0.0,
+                     "avg_rounds": round(t["rounds"] / t["wins"], 2) if t["wins"] else 0.0})
+    base = rows[0]
+    for r in rows:
+        r["delta"] = {k: round(r[k] - base[k], 4) for k in ("win_rate", "margin_per_call", "margin_per_win")}
+    return rows
+
+
+def load_policies(path: str = None, baseline: str = None) -> list:
+    policies = [negotiation.POLICY]
+    if path:
+        with open(path) as f:
+            policies += [Policy.from_spec(s) for s in json.load(f)]
+    if baseline:
+        policies.sort(key=lambda p: p.name != baseline)
+    return policies
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("source", choices=["synthetic", "replay"])
+    ap.add_argument("db", nargs="?", default=os.getenv("DB_PATH", "calls.db"))
+    ap.add_argument("--policies", help="JSON list of policy specs (the live policy is always included)")
+    ap.add_argument("--baseline", help="policy name the deltas are measured against (default: live)")
+    ap.add_argument("--n", type=int, default=1_000_000, help="synthetic scenarios")
+    ap.add_argument("--loads", help="draw synthetic listed rates from this loads.json")
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="also write the report as JSON")
+    args = ap.parse_args(argv)
+
+    policies = load_policies(args.policies, args.baseline)
+    if args.source == "synthetic":
+        rates = None
+        if args.loads:
+            with open(args.loads) as f:
+                rates = np.array([float(L["loadboard_rate"]) for L in json.load(f)])
+        sizes = [min(CHUNK, args.n - i) for i in range(0, args.n, CHUNK)]
+        chunks = [(_synthetic_chunk, (policies, n, args.seed + i, rates)) for i, n in enumerate(sizes)]
+    else:
+        from store import CallStore
+        store = CallStore(args.db)
+        chunks = [(_scenario_chunk, (policies, sc)) for sc in replay(store, args.seed)]
+        store.close()
+        if not chunks:
+            sys.exit(f"{args.db}: no negotiated calls to replay")
+
+    t = time.perf_counter()
+    rows = report(policies, run(policies, chunks, args.workers))
+    elapsed = time.perf_counter() - t
+    calls = rows[0]["calls"]
+    print(f"{calls} negotiations x {len(policies)} policies in {elapsed:.2f}s "
+          f"({calls * len(policies) / elapsed * 60 / 1e6:.1f}M/min)")
+    print(f"{'policy':<16}{'win rate':>10}{'Δ':>9}{'margin/call':>13}{'Δ':>9}{'margin/win':>12}{'rounds':>8}")
+    for r in rows:
+        print(f"{r['policy']:<16}{r['win_rate']:>10.2%}{r['delta']['win_rate']:>+9.2%}"
+              f"{r['margin_per_call']:>13.2f}{r['delta']['margin_per_call']:>+9.2f}"
+              f"{r['margin_per_win']:>12.2f}{r['avg_rounds']:>8.2f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"source": args.source, "seconds": round(elapsed, 3), "policies": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""SQLite access layer for the ``calls`` table.
+
+The database runs in WAL mode so dashboard reads never wait on log writes.
+Each process keeps one writer connection (serialized by a lock) and a small
+pool of reader connections; connections are long-lived so sqlite3's
+per-connection statement cache keeps the hot statements prepared. Every
+method blocks, so call it from a worker thread (sync endpoints run in
+FastAPI's threadpool, the write-behind flusher uses ``asyncio.to_thread``).
+
+Transcripts live in their own ``transcripts`` table, zlib-compressed and
+keyed by ``calls.id``, so the rows the indexes and metrics walk stay narrow;
+``calls.transcript`` is left NULL for new rows.
+
+Several uvicorn workers can share one file: schema changes run inside
+``BEGIN IMMEDIATE`` and every connection waits on ``busy_timeout`` instead
+of failing with "database is locked".
+"""
+import os, queue, sqlite3, threading, zlib
+from contextlib import contextmanager
+
+import rollups, telemetry
+
+CALLS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        call_id TEXT,
+        timestamp TEXT,
+        outcome TEXT,
+        sentiment TEXT,
+        rounds INTEGER,
+        mc TEXT, dot TEXT, legal_name TEXT,
+        selected_load_id TEXT,
+        origin TEXT, destination TEXT,
+        pickup_datetime TEXT, delivery_datetime TEXT,
+        equipment_type TEXT, miles INTEGER,
+        loadboard_rate REAL, agreed_rate REAL,
+        transcript TEXT,
+        ts INTEGER
+    )
+"""
+
+# ts: the call timestamp normalized to UTC epoch seconds by SQLite itself
+# (NULL when unparseable), so every writer and the migration agree
+TS_EXPR = "CAST(strftime('%s', {}) AS INTEGER)"
+CALLS_TS_MIGRATION = [
+    "ALTER TABLE calls ADD COLUMN ts INTEGER",
+    f"UPDATE calls SET ts = {TS_EXPR.format('timestamp')}",
+]
+
+CALLS_INDEXES = [
+    # time-range aggregates (all breakdowns) read only this index
+    """CREATE INDEX IF NOT EXISTS idx_calls_ts ON calls (
+        ts, outcome, sentiment, equipment_type, origin, destination, mc, agreed_rate, loadboard_rate)""",
+    # one lane / one carrier over a time range
+    """CREATE INDEX IF NOT EXISTS idx_calls_lane ON calls (
+        origin, destination, ts, outcome, agreed_rate, loadboard_rate)""",
+    """CREATE INDEX IF NOT EXISTS idx_calls_mc ON calls (
+        mc, ts, outcome, agreed_rate, loadboard_rate)""",
+]
+
+# call_id is the idempotency key for webhook retries; NULL ids never collide
+CALL_ID_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_calls_call_id ON calls (call_id)"
+CALL_ID_DEDUPE = """
+    DELETE FROM calls WHERE call_id IS NOT NULL AND id NOT IN (
+        SELECT MIN(id) FROM calls WHERE call_id IS NOT NULL GROUP BY call_id)
+"""
+
+TRANSCRIPTS_SCHEMA = "CREATE TABLE IF NOT EXISTS transcripts (call_row INTEGER PRIMARY KEY, body BLOB NOT NULL)"
+INSERT_TRANSCRIPT_SQL = "INSERT OR REPLACE INTO transcripts (call_row, body) VALUES (?, ?)"
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode(), 6)
+
+
+def decompress(body: bytes) -> str:
+    return zlib.decompress(body).decode() if body is not None else None
+
+
+# a retried call_id is ignored (and the rollup trigger does not fire for it)
+INSERT_CALL_SQL = f"""
+    INSERT OR IGNORE INTO calls (
+        call_id, timestamp, outcome, sentiment, rounds, mc, dot, legal_name,
+        selected_load_id, origin, destination, pickup_datetime, delivery_datetime,
+        equipment_type, miles, loadboard_rate, agreed_rate, transcript, ts
+    ) VALUES (?1,?2,?3,?4,?5,?6,?7,?8,?9,?10,?11,?12,?13,?14,?15,?16,?17,NULL,{TS_EXPR.format('?2')})
+"""
+
+
+class CallStore:
+    def __init__(self, path: str, readers: int = 4, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.readers = readers
+        self.busy_timeout_ms = busy_timeout_ms
+        self.last_id = 0  # id of the last row insert_calls stored; ids grow in commit order (AUTOINCREMENT)
+        self._reset()
+
+    def _reset(self):
+        # connections must not cross a fork; rebuild the pools in each worker process
+        self._pid = os.getpid()
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._pool_lock = threading.Lock()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                              check_same_thread=False, cached_statements=256,
+                              isolation_level=None)  # explicit BEGIN/COMMIT only
+        con.row_factory = sqlite3.Row
+        con.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoint; safe in WAL
+        return con
+
+    def init_schema(self):
+        with self.transaction() as con:
+            con.execute(CALLS_SCHEMA)
+            cols = {r["name"] for r in con.execute("PRAGMA table_xinfo(calls)")}
+            if "ts" not in cols:
+                for stmt in CALLS_TS_MIGRATION:
+                    con.execute(stmt)
+            for stmt in CALLS_INDEXES:
+                con.execute(stmt)
+            rollups.install(con)
+            has_transcripts = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transcripts'").fetchone()
+            if not con.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_calls_call_id'").fetchone():
+                # retries logged before call_id was unique: keep the first, recount the rollups
+                if con.execute(CALL_ID_DEDUPE).rowcount:
+                    rollups.backfill(con)
+                    if has_transcripts:
+                        con.execute("DELETE FROM transcripts WHERE NOT EXISTS (SELECT 1 FROM calls WHERE id = call_row)")
+                con.execute(CALL_ID_INDEX)
+            if not has_transcripts:
+                con.execute(TRANSCRIPTS_SCHEMA)
+                # move inline transcripts out of the calls table, after the dedupe so none is orphaned
+                moved = con.execute("SELECT id, transcript FROM calls WHERE transcript IS NOT NULL").fetchall()
+                con.executemany(INSERT_TRANSCRIPT_SQL, ((r[0], compress(r[1])) for r in moved))
+                if moved:
+                    con.execute("UPDATE calls SET transcript = NULL WHERE transcript IS NOT NULL")
+
+    # ---------- writes ----------
+    @contextmanager
+    def transaction(self):
+        """Writer connection inside BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error)."""
+        self._check_pid()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+            con = self._writer
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    def insert_calls(self, rows: list) -> list:
+        """Insert in one transaction; returns the rows actually stored (duplicate call_ids are skipped).
+
+        Rows are ``INSERT_CALL_SQL`` tuples; the last item (the transcript) goes to ``transcripts``.
+        """
+        stored = []
+        with telemetry.timed("sqlite.insert"), self.transaction() as con:
+            for r in rows:
+                cur = con.execute(INSERT_CALL_SQL, r[:17])
+                if cur.rowcount:
+                    stored.append(r)
+                    self.last_id = cur.lastrowid
+                    if r[17]:
+                        con.execute(INSERT_TRANSCRIPT_SQL, (cur.lastrowid, compress(str(r[17]))))
+        return stored
+
+    # ---------- reads ----------
+    @contextmanager
+    def reader(self):
+        self._check_pid()
+        try:
+            con = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                grow = self._opened < self.readers
+                if grow:
+                    self._opened += 1
+            if not grow:
+                con = self._pool.get()
+            else:
+                try:
+                    con = self.connect()
+                except Exception:
+                    with self._pool_lock:
+                        self._opened -= 1
+                    raise
+        try:
+            yield con
+        finally:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            self._pool.put(con)
+
+    def query(self, sql: str, params=()) -> list:
+        with self.reader() as con:
+            return con.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.execute("PRAGMA optimize")  # refresh planner stats for the range indexes
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._opened = 0
@@ -0,0 +1,222 @@
+"""Service telemetry: request and hot-path latency histograms, Prometheus text.
+
+``TelemetryMiddleware`` is a plain ASGI middleware (no per-request task or
+body buffering) that counts requests by route template, method and status
+and records their latency. Internal hot paths (scoring, SQLite inserts,
+Azure Table batches, metrics queries) are wrapped in ``timed(op)``.
+``render()`` turns everything into Prometheus text for ``GET /metrics``.
+Scrapes only read counters that already exist, so they cost the same however
+much traffic has been served.
+
+Opt-in profiling: with ``PROFILING_ENABLED=1``, a request that carries
+``x-profile: 1`` and a valid API key is sampled by ``Sampler``. The response
+gets an ``x-profile-id`` header, and the collapsed stacks (flamegraph /
+speedscope "folded" format) are kept for ``GET /debug/profile/{id}``. The
+sampler sees every thread in the process, so profile on a quiet instance.
+"""
+import os, sys, threading, time, uuid
+from bisect import bisect_left
+from collections import OrderedDict
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "") == "1"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.001"))
+PROFILES_KEPT = 16
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+_lock = threading.Lock()
+_requests = {}  # (route, method, status) -> count
+_latency = {}   # (route, method) -> Histogram
+_hot = {}       # op -> Histogram
+_gauges = {}    # name -> (help, fn returning a number or {label value: number}, label name)
+
+
+def observe(op: str, seconds: float):
+    with _lock:
+        h = _hot.get(op)
+        if h is None:
+            h = _hot[op] = Histogram()
+        h.observe(seconds)
+
+
+class timed:
+    """``with timed("sqlite.insert"): ...`` records the block into the hot-path histogram."""
+    __slots__ = ("op", "t")
+
+    def __init__(self, op: str):
+        self.op = op
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.op, time.perf_counter() - self.t)
+        return False
+
+
+def gauge(name: str, help: str, fn, label: str = None):
+    """Register a value read at scrape time (``fn`` returns a number, or a dict keyed by ``label``)."""
+    _gauges[name] = (help, fn, label)
+
+
+def record_request(route: str, method: str, status: int, seconds: float):
+    with _lock:
+        key = (route, method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        h = _latency.get((route, method))
+        if h is None:
+            h = _latency[(route, method)] = Histogram()
+        h.observe(seconds)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(name: str, labels: str, snap: tuple) -> list:
+    counts, total, count = snap
+    out, cum = [], 0
+    for bound, n in zip(BUCKETS + ("+Inf",), counts):
+        cum += n
+        out.append(f'{name}_bucket{{{labels},le="{bound}"}} {cum}')
+    out.append(f"{name}_sum{{{labels}}} {total:.6f}")
+    out.append(f"{name}_count{{{labels}}} {count}")
+    return out
+
+
+def _snapshot(histograms: dict) -> list:
+    return [(k, (list(h.counts), h.sum, h.count)) for k, h in sorted(histograms.items())]
+
+
+def render() -> str:
+    with _lock:
+        requests = sorted(_requests.items())
+        latency, hot = _snapshot(_latency), _snapshot(_hot)
+    lines = ["# HELP http_requests_total Requests served, by route template, method and status.",
+             "# TYPE http_requests_total counter"]
+    for (route, method, status), n in requests:
+        lines.append(f'http_requests_total{{route="{_esc(route)}",method="{method}",status="{status}"}} {n}')
+    lines += ["# HELP http_request_duration_seconds Request latency until the response is fully sent.",
+              "# TYPE http_request_duration_seconds histogram"]
+    for (route, method), h in latency:
+        lines += _histogram_lines("http_request_duration_seconds", f'route="{_esc(route)}",method="{method}"', h)
+    lines += ["# HELP hot_path_duration_seconds Time spent in instrumented internal operations.",
+              "# TYPE hot_path_duration_seconds histogram"]
+    for op, h in hot:
+        lines += _histogram_lines("hot_path_duration_seconds", f'op="{_esc(op)}"', h)
+    for name, (help, fn, label) in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception as e:
+            print("Telemetry gauge failed:", name, e)
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        if isinstance(value, dict):
+            lines += [f'{name}{{{label}="{_esc(k)}"}} {v}' for k, v in sorted(value.items())]
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- profiling ----------
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+_profiles = OrderedDict()  # id -> folded stacks text
+
+
+class Sampler:
+    """Polls every thread's stack at a fixed interval and counts collapsed stacks."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                # skip ourselves and threads parked in a wait/select/queue.get
+                if tid == me or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                names = []
+                while frame is not None:
+                    co = frame.f_code
+                    names.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(names))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def folded(self) -> str:
+        return "".join(f"{k} {n}\n" for k, n in sorted(self.stacks.items(), key=lambda kv: -kv[1]))
+
+
+def get_profile(profile_id: str):
+    return _profiles.get(profile_id)
+
+
+class TelemetryMiddleware:
+    def __init__(self, app, api_key: str = None):
+        self.app = app
+        self.api_key = api_key
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        sampler = None
+        if PROFILING_ENABLED:
+            headers = dict(scope.get("headers") or ())
+            if headers.get(b"x-profile") == b"1" and headers.get(b"x-api-key", b"").decode() == self.api_key:
+                sampler = Sampler().__enter__()
+                profile_id = uuid.uuid4().hex[:12]
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if sampler is not None:
+                    message["headers"] = list(message.get("headers", ())) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        t = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t
+            # route template, not the raw path, so label cardinality stays bounded
+            route = scope.get("route")
+            record_request(getattr(route, "path", "unmatched"), scope["method"], status, elapsed)
+            if sampler is not None:
+                sampler.__exit__()
+                _profiles[profile_id] = (f"# {scope['method']} {scope['path']} {elapsed * 1000:.1f} ms, "
+                                         f"{sampler.samples} samples every {sampler.interval * 1000:g} ms\n"
+                                         + sampler.folded())
+                while len(_profiles) > PROFILES_KEPT:
+                    _profiles.popitem(last=False)
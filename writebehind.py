@@ -0,0 +1,322 @@
+"""Write-behind pipeline for call logs.
+
+``/log_call`` enqueues and returns; a single flusher task drains the queue in
+batches off the event loop:
+
+* SQLite rows go in one multi-row transaction per batch; a call_id that is
+  already stored is skipped by the unique index.
+* Azure Table entities are grouped by PartitionKey into transactional
+  batches (max 100 operations / ~4 MB each) of upserts, so a retried call
+  (same RowKey) rewrites the same entity.
+* Entities Azure rejects are appended to a local JSONL spill file and
+  replayed later, so an outage never loses a call log.
+
+The queue is bounded: when it is full, ``submit`` waits up to
+``block_seconds`` and then raises ``QueueFull`` so the caller can shed load.
+"""
+import asyncio, json, os, re, threading, time
+from collections import OrderedDict, defaultdict
+from itertools import islice
+
+import telemetry
+
+TABLE_BATCH_MAX = 100
+TABLE_BATCH_BYTES = 4 * 1024 * 1024 - 64 * 1024  # headroom for the multipart envelope
+SPILL_REPLAY_CHUNK = 1000  # entities read from the spill file per pass
+PARTITION_FILTER = re.compile(r"^PartitionKey eq '([^']*)'$")  # the one filter MemoryTableClient understands
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RecentIds:
+    """Bounded LRU of recently logged call_ids: webhook retries are answered without touching storage."""
+
+    def __init__(self, capacity: int = 100_000):
+        self.capacity = capacity
+        self._ids = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def add(self, call_id) -> bool:
+        """Record ``call_id``; False if it was already there (a duplicate)."""
+        if call_id in self._ids:
+            self._ids.move_to_end(call_id)
+            self.stats["hits"] += 1
+            return False
+        self.stats["misses"] += 1
+        self._ids[call_id] = None
+        if len(self._ids) > self.capacity:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, call_id):
+        self._ids.pop(call_id, None)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MemoryTableClient:
+    """In-memory stand-in for azure.data.tables.TableClient (tests, benchmarks, local mode)."""
+
+    def __init__(self, max_entities: int = None):
+        self.entities = {}
+        self.max_entities = max_entities  # keep only the newest writes (local mode); None keeps all
+        self.fail = False  # flip to simulate an unreachable service
+        self.transactions = 0
+
+    def _trim(self):
+        if self.max_entities is not None:
+            for key in list(islice(self.entities, max(0, len(self.entities) - self.max_entities))):
+                del self.entities[key]
+
+    def _check(self):
+        if self.fail:
+            raise ConnectionError("table service unavailable")
+
+    def create_entity(self, entity: dict):
+        self._check()
+        key = (entity["PartitionKey"], entity["RowKey"])
+        if key in self.entities:
+            raise ValueError(f"entity already exists: {key}")
+        self.entities[key] = dict(entity)
+        self._trim()
+
+    def upsert_entity(self, entity: dict, **kwargs):
+        self._check()
+        key = (entity["PartitionKey"], entity["RowKey"])
+        self.entities.pop(key, None)
+        self.entities[key] = dict(entity)
+        self._trim()
+
+    def submit_transaction(self, operations):
+        self._check()
+        ops = list(operations)
+        if len(ops) > TABLE_BATCH_MAX or len({op[1]["PartitionKey"] for op in ops}) > 1:
+            raise ValueError("invalid batch")
+        staged = dict(self.entities)
+        for kind, entity in ops:
+            key = (entity["PartitionKey"], entity["RowKey"])
+            if kind == "create" and key in staged:
+                raise ValueError(f"entity already exists: {key}")
+            staged.pop(key, None)
+            staged[key] = dict(entity)
+        self.entities = staged
+        self._trim()
+        self.transactions += 1
+
+    def list_entities(self, **kwargs):
+        return iter(list(self.entities.values()))
+
+    def query_entities(self, query_filter: str = None, **kwargs):
+        m = PARTITION_FILTER.match(query_filter or "")
+        if m is None:
+            return self.list_entities()
+        return iter([e for (pk, _), e in list(self.entities.items()) if pk == m.group(1)])
+
+
+def table_batches(entities: list):
+    """Split entities into per-partition transactional batches within Azure's limits."""
+    by_partition = defaultdict(list)
+    for e in entities:
+        by_partition[e["PartitionKey"]].append(e)
+    for group in by_partition.values():
+        batch, size = [], 0
+        for e in group:
+            n = len(json.dumps(e, default=str))
+            if batch and (len(batch) >= TABLE_BATCH_MAX or size + n > TABLE_BATCH_BYTES):
+                yield batch
+                batch, size = [], 0
+            batch.append(e); size += n
+        if batch:
+            yield batch
+
+
+class CallLogWriter:
+    def __init__(self, table_client, write_rows, max_queue: int = 10000, batch_size: int = 500,
+                 flush_seconds: float = 0.25, block_seconds: float = 2.0,
+                 spill_path: str = "calls.spill.jsonl", retry_seconds: float = 30.0):
+        self.table_client = table_client
+        self.write_rows = write_rows  # callable(list of row tuples), one SQLite transaction
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self.spill_path = spill_path
+        self.retry_seconds = retry_seconds
+        self.on_flush = None  # callable(rows) run on the event loop after the rows are committed to SQLite
+        self.on_error = None  # callable(rows) run on the event loop when SQLite rejected the batch
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "table_batches": 0,
+                      "spilled": 0, "replayed": 0, "rejected": 0, "sqlite_errors": 0, "table_errors": 0, "duplicates": 0,
+                      "flush_errors": 0, "spill_corrupt": 0}
+        self._queue = None
+        self._task = None
+        self._spill_lock = threading.Lock()
+        self._last_retry = 0.0
+
+    # ---------- producer side ----------
+    async def submit(self, entities: list, row: tuple):
+        """Queue one call: its Azure entities (call fields, transcript) and its SQLite row."""
+        if self._queue is None:
+            # writer not running (e.g. a script importing the app): write through
+            await self._flush_and_notify([(entities, row)])
+            return
+        try:
+            self._queue.put_nowait((entities, row))
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put((entities, row)), self.block_seconds)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                raise QueueFull("call log queue is full")
+        self.stats["queued"] += 1
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting work and flush whatever is still queued."""
+        if self._task is None:
+            return
+        q, self._queue = self._queue, None  # later submits write through
+        await q.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        q = self._queue
+        done = False
+        while not done:
+            first = await q.get()
+            if first is None:
+                return
+            items = [first]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(items) < self.batch_size:
+                try:
+                    item = q.get_nowait()
+                except asyncio.QueueEmpty:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(q.get(), left)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    done = True
+                    break
+                items.append(item)
+            try:
+                await self._flush_and_notify(items)
+            except Exception as e:
+                # e.g. spill I/O: drop to the log and keep draining, or the queue never empties again
+                self.stats["flush_errors"] += 1
+                print("Call log flush failed:", e)
+
+    async def _flush_and_notify(self, items: list):
+        stored = await asyncio.to_thread(self._flush, items)
+        hook, rows = (self.on_error, [row for _, row in items]) if stored is None else (self.on_flush, stored)
+        if rows and hook is not None:
+            try:
+                hook(rows)
+            except Exception as e:
+                print("Call log flush hook failed:", e)
+
+    # ---------- flushing (worker thread) ----------
+    def _flush(self, items: list):
+        """Write one batch; returns the rows SQLite stored (retried call_ids drop out), None on failure."""
+        self.stats["batches"] += 1
+        rows = [row for _, row in items]
+        try:
+            stored = self.write_rows(rows)
+            stored = rows if stored is None else stored
+            self.stats["duplicates"] += len(rows) - len(stored)
+        except Exception as e:
+            stored = None
+            self.stats["sqlite_errors"] += 1
+            print("SQLite insert failed:", e)
+        # RowKeys derive from call_id, so a retry is the same entity: upsert is idempotent,
+        # and one batch must not carry the same key twice
+        entities = list({(e["PartitionKey"], e["RowKey"]): e for es, _ in items for e in es}.values())
+        failed = self._write_table(entities, "upsert")
+        if failed:
+            self._spill(failed)
+        elif time.monotonic() - self._last_retry >= self.retry_seconds:
+            self.replay_spill()
+        self.stats["written"] += len(items)
+        return stored
+
+    def _write_table(self, entities: list, op: str) -> list:
+        failed = []
+        for batch in table_batches(entities):
+            try:
+                with telemetry.timed("table.insert"):
+                    self.table_client.submit_transaction([(op, e) for e in batch])
+                self.stats["table_batches"] += 1
+            except Exception as e:
+                self.stats["table_errors"] += 1
+                print("Azure Table insert failed:", e)
+                failed.extend(batch)
+        return failed
+
+    def _spill(self, entities: list):
+        with self._spill_lock:
+            with open(self.spill_path, "a") as f:
+                for e in entities:
+                    f.write(json.dumps(e, default=str) + "\n")
+                f.flush(); os.fsync(f.fileno())
+        self.stats["spilled"] += len(entities)
+
+    def replay_spill(self, chunk: int = SPILL_REPLAY_CHUNK) -> int:
+        """Push spilled entities to Azure ``chunk`` at a time; whatever still fails stays spilled.
+
+        Lines that don't parse (a write cut short by a crash) are moved to ``<spill>.bad``.
+        """
+        self._last_retry = time.monotonic()
+        replayed = 0
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return 0
+            tmp = self.spill_path + ".tmp"
+            kept = 0
+            with open(self.spill_path) as src, open(tmp, "w") as out:
+                while True:
+                    lines = list(islice(src, chunk))
+                    if not lines:
+                        break
+                    entities, bad = [], []
+                    for line in lines:
+                        if line.strip():
+                            try:
+                                entities.append(json.loads(line))
+                            except ValueError:
+                                bad.append(line.rstrip("\n") + "\n")
+                    if bad:
+                        with open(self.spill_path + ".bad", "a") as f:
+                            f.writelines(bad)
+                        self.stats["spill_corrupt"] += len(bad)
+                        print(f"Skipped {len(bad)} unreadable spill lines")
+                    if not entities:
+                        continue
+                    # upsert: a batch may have landed before the error reached us
+                    failed = self._write_table(entities, "upsert")
+                    for e in failed:
+                        out.write(json.dumps(e, default=str) + "\n")
+                    kept += len(failed)
+                    replayed += len(entities) - len(failed)
+                out.flush(); os.fsync(out.fileno())
+            if kept:
+                os.replace(tmp, self.spill_path)
+            else:
+                os.remove(tmp)
+                os.remove(self.spill_path)
+        self.stats["replayed"] += replayed
+        return replayed